@@ -0,0 +1,70 @@
+"""
+Compares the latency of cache hits across the cache backends. Responses are fetched once from a local stand-in
+for the web services, then requested again so they're all served from the cache:
+
+    python benchmarks/cache_backends.py --entries 500 --rounds 5
+"""
+
+import os
+import time
+import argparse
+import tempfile
+from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.local_server import LocalServer
+from chembl_webresource_client.local_server import make_dataset
+from chembl_webresource_client.cache_backends import BACKENDS
+from chembl_webresource_client.session import get_session
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def benchmark(backend, urls, rounds):
+    session = get_session(urls[0], backend=backend)
+    for url in urls:
+        session.get(url).raise_for_status()
+    timings = []
+    for _ in range(rounds):
+        for url in urls:
+            start = time.perf_counter()
+            res = session.get(url)
+            timings.append(time.perf_counter() - start)
+            assert res.from_cache
+    return timings
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=500, help='distinct responses in the cache')
+    parser.add_argument('--rounds', type=int, default=5, help='times every response is read back')
+    parser.add_argument('--eviction', choices=('lru', 'lfu'), default='lru')
+    parser.add_argument('backends', nargs='*', default=BACKENDS)
+    args = parser.parse_args()
+
+    server = LocalServer(resources=make_dataset(molecules=args.entries)).start()
+    settings = Settings.Instance()
+    settings.CACHING = True
+    settings.CACHE_EVICTION = args.eviction
+    settings.CACHE_NAME = os.path.join(tempfile.mkdtemp(), 'chembl_ws_client_benchmark')
+    urls = ['{0}/molecule/CHEMBL{1}.json'.format(server.url, i) for i in range(1, args.entries + 1)]
+    try:
+        print('{0:<12} {1:>12} {2:>12} {3:>12}'.format('backend', 'median (us)', 'p95 (us)', 'hits/s'))
+        for backend in args.backends:
+            timings = benchmark(backend, urls, args.rounds)
+            print('{0:<12} {1:12.1f} {2:12.1f} {3:12.0f}'.format(backend, percentile(timings, 0.5) * 1e6,
+                                                                percentile(timings, 0.95) * 1e6,
+                                                                len(timings) / sum(timings)))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
+
+#-----------------------------------------------------------------------------------------------------------------------
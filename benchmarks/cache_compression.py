@@ -0,0 +1,92 @@
+"""
+Shows the disk space and read latency trade-off of cache compression. The same responses are cached with every
+compression setting, then read back cold (with a new cache handle, so nothing is reused from memory):
+
+    python benchmarks/cache_compression.py --entries 50 --page-size 1000 --rounds 3
+"""
+
+import os
+import time
+import argparse
+import tempfile
+from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.local_server import LocalServer
+from chembl_webresource_client.local_server import make_dataset
+from chembl_webresource_client.compression import _zstd
+from chembl_webresource_client.session import get_session, get_cache_path, close_sessions
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+SETTINGS = [(None, None), ('zlib', 1), ('zlib', 6), ('zlib', 9), ('zstd', 3), ('zstd', 10)]
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def fetch(session, url, page):
+    return session.post(url, json=page, headers={'X-HTTP-Method-Override': 'GET'})
+
+
+def benchmark(method, level, url, pages, rounds):
+    settings = Settings.Instance()
+    settings.CACHE_COMPRESSION, settings.CACHE_COMPRESSION_LEVEL = method, level
+    settings.CACHE_NAME = os.path.join(tempfile.mkdtemp(), 'chembl_ws_client_benchmark')
+    session = get_session(url)
+    start = time.perf_counter()
+    for page in pages:
+        fetch(session, url, page).raise_for_status()
+    write_time = time.perf_counter() - start
+    close_sessions()
+    size = os.path.getsize(get_cache_path() + '.sqlite')
+    timings = []
+    for _ in range(rounds):
+        session = get_session(url)
+        for page in pages:
+            start = time.perf_counter()
+            res = fetch(session, url, page)
+            timings.append(time.perf_counter() - start)
+            assert res.from_cache
+        close_sessions()
+    return size, write_time / len(pages), timings
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=50, help='distinct pages in the cache')
+    parser.add_argument('--page-size', type=int, default=1000, help='activities per page')
+    parser.add_argument('--rounds', type=int, default=3, help='times every page is read back')
+    args = parser.parse_args()
+
+    server = LocalServer(resources=make_dataset(activities=args.entries * args.page_size)).start()
+    settings = Settings.Instance()
+    settings.CACHING = True
+    settings.RELEASE_AWARE_CACHING = False
+    settings.CACHE_MAX_SIZE = None
+    url = server.url + '/activity.json'
+    pages = [[['limit', args.page_size], ['offset', i * args.page_size]] for i in range(args.entries)]
+    try:
+        print('{0:<12} {1:>12} {2:>12} {3:>14} {4:>14}'.format('compression', 'size (MB)', 'write (us)',
+                                                              'read p50 (us)', 'read p95 (us)'))
+        for method, level in SETTINGS:
+            if method == 'zstd' and _zstd() is None:
+                print('{0:<12} zstandard is not installed'.format('zstd-{0}'.format(level)))
+                continue
+            size, write_time, timings = benchmark(method, level, url, pages, args.rounds)
+            name = '{0}-{1}'.format(method, level) if method else 'none'
+            print('{0:<12} {1:12.2f} {2:12.1f} {3:14.1f} {4:14.1f}'.format(name, size / 1e6, write_time * 1e6,
+                                                                         percentile(timings, 0.5) * 1e6,
+                                                                         percentile(timings, 0.95) * 1e6))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
+
+#-----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,82 @@
+"""
+Stress test of a cache shared by several processes, as in a pool of workers that all use the client. Every
+process requests records from a local stand-in for the web services, half of them also requested by the other
+processes, through the same sqlite cache file; then all of them read everything back from the cache:
+
+    python benchmarks/cache_concurrency.py --processes 32 --requests 200
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing
+from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.local_server import LocalServer
+from chembl_webresource_client.local_server import make_dataset
+from chembl_webresource_client.session import get_session
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def worker(args):
+    url, cache_name, wal, busy_timeout, worker_id, requests, start_at = args
+    settings = Settings.Instance()
+    settings.CACHING = True
+    settings.RELEASE_AWARE_CACHING = False
+    settings.CACHE_NAME = cache_name
+    settings.CACHE_WAL = wal
+    settings.CACHE_BUSY_TIMEOUT = busy_timeout
+    session = get_session(url)
+    # the first half of the ids is shared by all the workers, the second half is only requested by this one
+    ids = [i % (requests // 2) + 1 if i < requests // 2 else worker_id * requests + i + 1 for i in range(requests)]
+    errors = 0
+    timings = []
+    while time.time() < start_at:
+        time.sleep(0.001)
+    for _ in range(2):
+        start = time.perf_counter()
+        for i in ids:
+            try:
+                session.get('{0}/molecule/CHEMBL{1}.json'.format(url, i)).raise_for_status()
+            except Exception:
+                errors += 1
+        timings.append(time.perf_counter() - start)
+    return timings, errors
+
+
+def run(url, processes, requests, wal, busy_timeout):
+    """Returns the throughput (requests/s) of the pass filling the cache, the one reading it and the errors."""
+    cache_name = os.path.join(tempfile.mkdtemp(), 'chembl_ws_client_benchmark')
+    start_at = time.time() + 1
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(worker, [(url, cache_name, wal, busy_timeout, i, requests, start_at)
+                                    for i in range(processes)])
+    fill = processes * requests / max(r[0][0] for r in results)
+    read = processes * requests / max(r[0][1] for r in results)
+    return fill, read, sum(r[1] for r in results)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='distinct records requested by every process')
+    args = parser.parse_args()
+
+    server = LocalServer(resources=make_dataset(molecules=(args.processes + 1) * args.requests)).start()
+    try:
+        print('{0:<26} {1:>12} {2:>12} {3:>8}'.format('sqlite', 'fill req/s', 'read req/s', 'errors'))
+        for name, wal, busy_timeout in (('rollback journal', False, None), ('rollback, busy timeout', False, 30000),
+                                        ('wal, busy timeout', True, 30000)):
+            fill, read, errors = run(server.url, args.processes, args.requests, wal, busy_timeout)
+            print('{0:<26} {1:12.0f} {2:12.0f} {3:8d}'.format(name, fill, read, errors))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
+
+#-----------------------------------------------------------------------------------------------------------------------
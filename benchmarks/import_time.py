@@ -0,0 +1,66 @@
+"""
+Measures the import time of each entry point of the client with `python -X importtime`, in a fresh interpreter
+each time so the results don't depend on what was imported before. Pass `--budget` (milliseconds) to exit with
+a non-zero status when any entry point gets slower than that, e.g. on CI:
+
+    python benchmarks/import_time.py --repeat 5 --budget 150
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+ENTRY_POINTS = (
+    'chembl_webresource_client',
+    'chembl_webresource_client.new_client',
+    'chembl_webresource_client.utils',
+    'chembl_webresource_client.unichem',
+    'chembl_webresource_client.async_client',
+    'chembl_webresource_client.scripts.chembl_ids',
+    'chembl_webresource_client.scripts.chembl_act',
+)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def import_time(module, env):
+    """Returns the cumulative import time of `module` in microseconds."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, env=env, universal_newlines=True)
+    if proc.returncode:
+        raise Exception('Importing {0} failed:\n{1}'.format(module, proc.stderr))
+    for line in proc.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    raise Exception('No import time reported for {0}'.format(module))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per entry point, the best one is reported')
+    parser.add_argument('--budget', type=float, help='maximum import time in milliseconds')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS)
+    args = parser.parse_args()
+
+    # run from an empty home directory so persisted schemas or caches don't make imports look cheaper
+    env = dict(os.environ, HOME=tempfile.mkdtemp())
+    over_budget = []
+    for module in args.modules:
+        best = min(import_time(module, env) for _ in range(args.repeat)) / 1000.0
+        print('{0:<50} {1:8.1f} ms'.format(module, best))
+        if args.budget is not None and best > args.budget:
+            over_budget.append(module)
+    if over_budget:
+        print('Over the {0} ms budget: {1}'.format(args.budget, ', '.join(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
+#-----------------------------------------------------------------------------------------------------------------------
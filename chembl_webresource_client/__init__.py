@@ -1,8 +1,7 @@
 __author__ = 'mnowotka'
 
 try:
-    __version__ = __import__('pkg_resources').get_distribution('chembl_webresource_client').version
+    from importlib.metadata import version as _get_version
+    __version__ = _get_version('chembl_webresource_client')
 except Exception as e:
     __version__ = 'development'
-
-import requests
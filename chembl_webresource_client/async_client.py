@@ -0,0 +1,159 @@
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.new_client import NewClient
+from chembl_webresource_client.new_client import client_from_schema
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=Settings.Instance().CONCURRENT_SIZE)
+    return _executor
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), partial(func, *args))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+class AsyncQuerySet(object):
+    """
+    Asyncio counterpart of `QuerySet`. Refining methods (`filter`, `only`, `order_by`, slicing...) build the same
+    `UrlQuery` as the synchronous API; only the methods hitting the network are coroutines. Requests go through
+    the shared session (and its cache) on a thread pool, so they never block the event loop and many of them can
+    be gathered concurrently.
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self.model = queryset.model
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def __repr__(self):
+        return '<AsyncQuerySet {0}>'.format(self.queryset.url() if self.queryset.query.allows_list
+                                            else self.model.name)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def _wrap(self, queryset):
+        return self.__class__(queryset) if queryset is not None else None
+
+    def all(self):
+        return self._wrap(self.queryset.all())
+
+    def filter(self, **kwargs):
+        return self._wrap(self.queryset.filter(**kwargs))
+
+    def search(self, query):
+        return self._wrap(self.queryset.search(query))
+
+    def order_by(self, *field_names):
+        return self._wrap(self.queryset.order_by(*field_names))
+
+    def only(self, *field_names):
+        return self._wrap(self.queryset.only(*field_names))
+
+    def page_size(self, size):
+        return self._wrap(self.queryset.page_size(size))
+
+    def keyset(self, field, after=None):
+        return self._wrap(self.queryset.keyset(field, after))
+
+    def read_ahead(self, pages=1):
+        return self._wrap(self.queryset.read_ahead(pages))
+
+    def using(self, backend):
+        return self._wrap(self.queryset.using(backend))
+
+    def set_format(self, frmt):
+        self.queryset.set_format(frmt)
+
+    def url(self):
+        return self.queryset.url()
+
+    def __getitem__(self, k):
+        assert isinstance(k, slice), "Use `await qs.first()` or a slice to access single elements."
+        return self._wrap(self.queryset[k])
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def get(self, *args, **kwargs):
+        """
+        `get('CHEMBL25')` and `get([...])` fetch records by id and must be awaited, `get(name=...)` only refines
+        the query, like `filter`, so it returns an `AsyncQuerySet` right away.
+        """
+        if args:
+            return _run(self.queryset.get, *args)
+        if kwargs:
+            return self._wrap(self.queryset.get(**kwargs))
+
+    async def count(self):
+        return await _run(len, self.queryset)
+
+    async def exists(self):
+        return bool(await self.count())
+
+    async def first(self):
+        async for record in self[0:1]:
+            return record
+
+    async def list(self):
+        return [record async for record in self]
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    async def pages(self):
+        """
+        Yields the results page by page, fetched like the synchronous API does (keyset pagination, adaptive page
+        size, read ahead). The next page is requested as soon as the current one arrives, so the consumer working
+        through a page overlaps with the network round trip for the following one.
+        """
+        pages = self.queryset.query.clone().iterate_pages()
+        pending = asyncio.ensure_future(_run(next, pages, None))
+        try:
+            while pending is not None:
+                page = await pending
+                pending = None
+                if page is not None:
+                    pending = asyncio.ensure_future(_run(next, pages, None))
+                    yield page
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def __aiter__(self):
+        async for page in self.pages():
+            for record in page:
+                yield record
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+class AsyncNewClient(NewClient):
+
+    def _make_resource(self, model, default_format):
+        return AsyncQuerySet(super(AsyncNewClient, self)._make_resource(model, default_format))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+def async_client_from_schema(schema):
+    """Builds an asyncio client from a SPORE schema, exposing the same resources as `new_client`"""
+
+    return client_from_schema(schema, client_class=AsyncNewClient)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+def __getattr__(name):
+    if name == 'async_new_client':
+        from chembl_webresource_client.new_client import new_client
+        globals()[name] = async_client_from_schema(new_client.description)
+        return globals()[name]
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+#-----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,252 @@
+"""
+Cache bundles: a snapshot of some of the cached responses in a single file, to give other machines (e.g. the nodes
+of a cluster) a warm cache without each of them downloading the same data. A bundle is a sqlite file holding
+every distinct response body once, compressed and addressed by its SHA-256 digest, and an index from cache keys
+to the rest of the responses. Bundles are either imported into a cache or mounted read-only with
+`Settings.CACHE_BUNDLES`, in which case responses missing from the cache are looked up in them.
+"""
+
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections.abc import MutableMapping
+from contextlib import closing
+from urllib.parse import urlparse, parse_qsl
+from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.compression import compress, decompress
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+FORMAT_VERSION = '1'
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def _cattr_stage():
+    from requests_cache.serializers import pickle_serializer
+    return pickle_serializer.stages[0]
+
+
+def _request_params(request):
+    """Returns the (filter, value) pairs of a cached request, from its query string or its JSON body."""
+    params = [(key, value) for key, value in parse_qsl(urlparse(request.url).query)]
+    if request.body:
+        try:
+            body = json.loads(request.body)
+        except (TypeError, ValueError):
+            body = None
+        if isinstance(body, list):
+            params.extend((str(pair[0]), str(pair[1])) for pair in body if isinstance(pair, (list, tuple)) and
+                          len(pair) == 2)
+    return params
+
+
+def matches(response, resources=None, filters=None):
+    """
+    Tells whether a cached response belongs to one of `resources` (names as reported by `chembl_cache stats`,
+    e.g. molecule or molecule/search) and its request used all the `filters`, (name, value) pairs.
+    """
+    from chembl_webresource_client.cache_stats import resource_label
+    if resources and resource_label(response.url) not in resources:
+        return False
+    if filters:
+        params = _request_params(response.request)
+        return all((name, str(value)) in params for name, value in filters)
+    return True
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def export_bundle(cache, path, keys=None, resources=None, filters=None, since=None, method=None, level=None,
+                  backend=None):
+    """
+    Writes the responses of `cache` selected by `keys`, `resources` and `filters` (see `matches`), or those used
+    since the `since` timestamp according to the cache statistics, to the bundle file at `path`.
+    Bundled responses never expire, the bundle is tagged with the ChEMBL release of the cache instead.
+    `backend` is the backend of `cache`, which the statistics and the release marker are kept for.
+    Returns the number of responses written.
+    """
+    from chembl_webresource_client.cache_stats import read_stats
+    from chembl_webresource_client.release import read_release_marker
+    stage = _cattr_stage()
+    method = method or Settings.Instance().CACHE_COMPRESSION or 'zlib'
+    selected = set(keys) if keys is not None else None
+    if since is not None:
+        _, used = read_stats(backend)
+        touched = set(key for key, (_, last_used) in used.items() if last_used and last_used >= since)
+        selected = touched if selected is None else selected & touched
+    count = 0
+    with closing(sqlite3.connect(path)) as con, con:
+        con.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        con.execute('CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB)')
+        con.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, digest TEXT, response BLOB)')
+        con.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+            ('format', FORMAT_VERSION), ('release', read_release_marker(backend) or ''), ('created', str(time.time()))])
+        for key in (list(selected) if selected is not None else list(cache.responses.keys())):
+            response = cache.responses.get(key)
+            if response is None or not matches(response, resources, filters):
+                continue
+            obj = stage.dumps(response)
+            content = obj.pop('_content', None) or b''
+            obj['expires'] = None
+            digest = hashlib.sha256(content).hexdigest()
+            if con.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone() is None:
+                con.execute('INSERT INTO blobs VALUES (?, ?)', (digest, compress(content, method, level)))
+            con.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                        (key, digest, compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), 'zlib')))
+            count += 1
+    with closing(sqlite3.connect(path)) as con:
+        con.execute('VACUUM')
+    return count
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class Bundle(object):
+    """A bundle file opened read-only."""
+
+    def __init__(self, path):
+        self.path = path
+        self._con = sqlite3.connect('file:{0}?mode=ro'.format(path), uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        meta = dict(self._con.execute('SELECT name, value FROM meta').fetchall())
+        self.release = meta.get('release') or None
+
+    def get(self, key):
+        with self._lock:
+            row = self._con.execute('SELECT entries.response, blobs.data FROM entries JOIN blobs '
+                                    'ON entries.digest = blobs.digest WHERE entries.key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        obj = pickle.loads(decompress(row[0]))
+        obj['_content'] = decompress(row[1])
+        return _cattr_stage().loads(obj)
+
+    def keys(self):
+        with self._lock:
+            return [row[0] for row in self._con.execute('SELECT key FROM entries')]
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+
+def import_bundle(path, cache, backend=None):
+    """
+    Copies the responses of the bundle at `path` into `cache` (using `backend`) and returns their number.
+    A bundle holding data from a ChEMBL release other than the one of the cache is refused.
+    """
+    from chembl_webresource_client.release import read_release_marker, write_release_marker
+    bundle = Bundle(path)
+    count = 0
+    try:
+        known = read_release_marker(backend)
+        if known and bundle.release and bundle.release != known:
+            raise Exception('The cache bundle {0} holds data from {1} and the cache from {2}'.format(
+                path, bundle.release, known))
+        keys = bundle.keys()
+        for start in range(0, len(keys), 500):
+            with cache.responses.bulk_commit():
+                for key in keys[start:start + 500]:
+                    response = bundle.get(key)
+                    if response is not None:
+                        cache.responses[key] = response
+                        count += 1
+        if bundle.release and not known:
+            write_release_marker(bundle.release, backend)
+    finally:
+        bundle.close()
+    return count
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class BundleStorage(MutableMapping):
+    """
+    Wraps the responses storage of a cache so responses it doesn't have are looked up in read-only bundles.
+    Everything else, including writes, goes to the wrapped storage; the bundles are never modified.
+    """
+
+    def __init__(self, storage, bundles):
+        self.storage = storage
+        self.bundles = bundles
+
+    def __getattr__(self, name):
+        if name == 'storage':
+            raise AttributeError(name)
+        return getattr(self.storage, name)
+
+    def __getitem__(self, key):
+        try:
+            return self.storage[key]
+        except KeyError:
+            for bundle in self.bundles:
+                response = bundle.get(key)
+                if response is not None:
+                    return response
+            raise
+
+    def __setitem__(self, key, value):
+        self.storage[key] = value
+
+    def __delitem__(self, key):
+        del self.storage[key]
+
+    def __iter__(self):
+        return iter(self.storage)
+
+    def __len__(self):
+        return len(self.storage)
+
+    def clear(self):
+        self.storage.clear()
+
+    def retain_release(self, release):
+        """Stops using the bundles holding data from a ChEMBL release other than `release`."""
+        for bundle in [bundle for bundle in self.bundles if bundle.release and bundle.release != release]:
+            logger.info('Not using the cache bundle {0} anymore, it holds data from {1}'.format(bundle.path,
+                                                                                               bundle.release))
+            self.bundles.remove(bundle)
+            bundle.close()
+
+    def close(self):
+        for bundle in self.bundles:
+            bundle.close()
+        self.storage.close()
+
+
+def mount_bundles(cache, paths, backend=None):
+    """
+    Makes `cache` fall back to the bundles at `paths`. Bundles tagged with a ChEMBL release other than the one of
+    the cache are skipped, as their data is out of date.
+    """
+    from chembl_webresource_client.release import read_release_marker
+    known = read_release_marker(backend)
+    bundles = []
+    for path in paths:
+        try:
+            bundle = Bundle(path)
+        except sqlite3.Error as e:
+            logger.warning('Could not open the cache bundle {0}: {1}'.format(path, e))
+            continue
+        if known and bundle.release and bundle.release != known:
+            logger.warning('Not using the cache bundle {0}, it holds data from {1} and the cache from {2}'.format(
+                path, bundle.release, known))
+            bundle.close()
+            continue
+        bundles.append(bundle)
+    if bundles:
+        cache.responses = BundleStorage(cache.responses, bundles)
+    return cache
+
+#-----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,438 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from requests_cache.backends.base import BaseCache, BaseStorage, DictStorage
+from requests_cache.backends.sqlite import SQLiteCache, SQLiteDict
+from requests_cache.backends.filesystem import FileCache, FileDict
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+BACKENDS = ('sqlite', 'memory', 'filesystem')
+EVICTION_POLICIES = ('lru', 'lfu')
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class BoundedStorageMixin(object):
+    """
+    Keeps the total size of the serialized responses held by a `requests_cache` storage under `max_size` bytes,
+    evicting the least recently (`lru`) or least frequently (`lfu`) used entries first.
+
+    The size and access statistics are kept in memory. They are built from the storage the first time they're
+    needed, so entries written by an earlier run (or another process) are accounted for but ranked as the least
+    recently and least frequently used ones. Storages shared by several processes set `refresh_interval`, the
+    statistics are then merged with the storage that often, picking up what the other processes wrote or evicted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.max_size = kwargs.pop('max_size', None)
+        self.eviction = kwargs.pop('eviction', 'lru')
+        self.refresh_interval = kwargs.pop('refresh_interval', None)
+        assert self.eviction in EVICTION_POLICIES, 'Unknown eviction policy {0}'.format(self.eviction)
+        super(BoundedStorageMixin, self).__init__(*args, **kwargs)
+        self._index = None
+        self._index_time = 0
+        self._total_size = 0
+        self._index_lock = threading.RLock()
+        self._written = threading.local()
+        self.evictions = 0
+
+    def _stored_sizes(self):
+        """Yields (key, size) for the entries already in the storage, least recently written first."""
+        raise NotImplementedError
+
+    def _get_index(self):
+        if self._index is None or (self.refresh_interval is not None and
+                                   time.time() - self._index_time > self.refresh_interval):
+            known = self._index or {}
+            stored = OrderedDict((key, [size, 0]) for key, size in self._stored_sizes())
+            # entries only known from the storage rank first, the ones used by this process keep their order and hits
+            index = OrderedDict((key, entry) for key, entry in stored.items() if key not in known)
+            for key, entry in known.items():
+                if key in stored:
+                    index[key] = [stored[key][0], entry[1]]
+            self._total_size = sum(entry[0] for entry in index.values())
+            self._index = index
+            self._index_time = time.time()
+        return self._index
+
+    @property
+    def total_size(self):
+        with self._index_lock:
+            self._get_index()
+            return self._total_size
+
+    def reset_index(self):
+        """Forgets the statistics, so they're rebuilt from the storage. Needed after deleting entries behind its back."""
+        with self._index_lock:
+            self._index = None
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def serialize(self, value):
+        value = super(BoundedStorageMixin, self).serialize(value)
+        self._written.size = len(value) if value is not None else 0
+        return value
+
+    def __getitem__(self, key):
+        value = super(BoundedStorageMixin, self).__getitem__(key)
+        with self._index_lock:
+            entry = self._get_index().get(key)
+            if entry is not None:
+                entry[1] += 1
+                self._index.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._index_lock:
+            super(BoundedStorageMixin, self).__setitem__(key, value)
+            index = self._get_index()
+            size = self._written.size
+            hits = 0
+            if key in index:
+                old_size, hits = index.pop(key)
+                self._total_size -= old_size
+            index[key] = [size, hits]
+            self._total_size += size
+            self._evict(protect=key)
+
+    def __delitem__(self, key):
+        with self._index_lock:
+            super(BoundedStorageMixin, self).__delitem__(key)
+            self._forget(key)
+
+    @contextmanager
+    def bulk_commit(self):
+        # the statistics are locked before the storage by every write, a transaction must do the same
+        with self._index_lock:
+            bulk_commit = getattr(super(BoundedStorageMixin, self), 'bulk_commit', None)
+            if bulk_commit is None:
+                yield
+            else:
+                with bulk_commit():
+                    yield
+
+    def bulk_delete(self, keys=None, **kwargs):
+        with self._index_lock:
+            keys = list(keys or [])
+            super(BoundedStorageMixin, self).bulk_delete(keys, **kwargs)
+            if kwargs:
+                self._index = None
+            for key in keys:
+                self._forget(key)
+
+    def clear(self):
+        with self._index_lock:
+            super(BoundedStorageMixin, self).clear()
+            self._index = OrderedDict()
+            self._total_size = 0
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def _forget(self, key):
+        if self._index is not None and key in self._index:
+            self._total_size -= self._index.pop(key)[0]
+
+    def _evict(self, protect=None):
+        if self.max_size is None or self._total_size <= self.max_size:
+            return
+        if self.eviction == 'lfu':
+            # sorted() is stable, so entries used equally often go in least recently used order
+            victims = sorted(self._index, key=lambda k: self._index[k][1])
+        else:
+            victims = list(self._index)
+        # the entry being written goes last, it only has to go if it doesn't fit in the cache on its own
+        victims = [key for key in victims if key != protect] + ([protect] if protect in self._index else [])
+        for key in victims:
+            if self._total_size <= self.max_size:
+                break
+            try:
+                super(BoundedStorageMixin, self).__delitem__(key)
+            except KeyError:
+                pass
+            self._forget(key)
+            self.evictions += 1
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class WriteBehindStorage(MutableMapping):
+    """
+    Wraps the responses storage of a cache so responses are written by a background thread instead of the thread
+    making the request. They're written in one transaction whenever `batch_size` are pending or `interval`
+    seconds passed, and served from memory until then. If the bodies of the pending responses add up to more
+    than `max_pending` bytes, the thread storing one more writes them all itself. Everything pending is written
+    when the cache is closed, which `close_sessions` does at exit. Anything else is passed to the wrapped storage.
+    """
+
+    _flushed_first = ('count', 'sorted', 'vacuum', 'bulk_delete', 'total_size', 'reset_index')
+
+    def __init__(self, storage, batch_size=100, interval=1.0, max_pending=None):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._pending_size = 0
+        self._cond = threading.Condition()
+        # held while writing to the storage, always before any lock of the storage itself
+        self._write_lock = threading.RLock()
+        self._direct = threading.local()
+        self._thread = None
+        self._closed = False
+
+    def __getattr__(self, name):
+        if name == 'storage':
+            raise AttributeError(name)
+        if name in self._flushed_first:
+            self.flush()
+        return getattr(self.storage, name)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def __getitem__(self, key):
+        with self._cond:
+            if key in self._pending:
+                return self._pending[key]
+        return self.storage[key]
+
+    def __setitem__(self, key, value):
+        if getattr(self._direct, 'active', False):
+            self._discard(key)
+            self.storage[key] = value
+            return
+        with self._cond:
+            self._discard(key)
+            self._pending[key] = value
+            self._pending_size += self._size(value)
+            full = self.max_pending is not None and self._pending_size > self.max_pending
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name='chembl-cache-writer', daemon=True)
+                self._thread.start()
+        if full:
+            self.flush()
+
+    def __delitem__(self, key):
+        with self._write_lock:
+            with self._cond:
+                pending = self._discard(key)
+            try:
+                del self.storage[key]
+            except KeyError:
+                if not pending:
+                    raise
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.storage)
+
+    def __len__(self):
+        self.flush()
+        return len(self.storage)
+
+    def clear(self):
+        with self._write_lock:
+            with self._cond:
+                self._pending.clear()
+                self._pending_size = 0
+            self.storage.clear()
+
+    @contextmanager
+    def bulk_commit(self):
+        """Writes what's pending, then writes directly to the storage in one transaction, as its `bulk_commit`."""
+        with self._write_lock:
+            self.flush()
+            with _bulk_commit(self.storage):
+                self._direct.active = True
+                try:
+                    yield
+                finally:
+                    self._direct.active = False
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        self.storage.close()
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _size(value):
+        return len(getattr(value, '_content', None) or b'')
+
+    def _discard(self, key):
+        value = self._pending.pop(key, None)
+        if value is not None:
+            self._pending_size -= self._size(value)
+        return value is not None
+
+    def flush(self):
+        """Writes all the pending responses."""
+        with self._write_lock:
+            with self._cond:
+                batch = list(self._pending.items())
+            if not batch:
+                return
+            try:
+                with _bulk_commit(self.storage):
+                    for key, value in batch:
+                        self.storage[key] = value
+            except Exception as e:
+                logger.warning('Could not write {0} responses to the cache: {1}'.format(len(batch), e))
+            with self._cond:
+                for key, value in batch:
+                    # unless it was replaced in the meantime
+                    if self._pending.get(key) is value:
+                        self._discard(key)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+
+@contextmanager
+def _bulk_commit(storage):
+    if getattr(storage, 'bulk_commit', None) is not None:
+        with storage.bulk_commit():
+            yield
+    else:
+        yield
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class MemoryDict(BaseStorage):
+    """In-process storage keeping responses serialized, so their size is known and they're isolated from callers."""
+
+    def __init__(self, serializer='pickle', **kwargs):
+        super(MemoryDict, self).__init__(serializer=serializer, **kwargs)
+        self._data = {}
+
+    def __getitem__(self, key):
+        return self.deserialize(key, self._data[key])
+
+    def __setitem__(self, key, value):
+        self._data[key] = self.serialize(value)
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+
+
+class BoundedMemoryDict(BoundedStorageMixin, MemoryDict):
+
+    def _stored_sizes(self):
+        return []
+
+
+class BoundedSQLiteDict(BoundedStorageMixin, SQLiteDict):
+
+    def _stored_sizes(self):
+        with self.connection() as con:
+            return con.execute('SELECT key, LENGTH(value) FROM {0} ORDER BY rowid'.format(self.table_name)).fetchall()
+
+
+class BoundedFileDict(BoundedStorageMixin, FileDict):
+
+    def _stored_sizes(self):
+        stats = [(path.stem, path.stat()) for path in self.paths()]
+        return [(key, stat.st_size) for key, stat in sorted(stats, key=lambda item: item[1].st_mtime)]
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class MemoryCache(BaseCache):
+    """Cache held by the current process only."""
+
+    def __init__(self, cache_name='memory', max_size=None, eviction='lru', serializer='pickle', **kwargs):
+        super(MemoryCache, self).__init__(cache_name=cache_name, **kwargs)
+        self.responses = BoundedMemoryDict(max_size=max_size, eviction=eviction, serializer=serializer)
+        self.redirects = DictStorage()
+
+
+class BoundedSQLiteCache(SQLiteCache):
+    """`requests_cache.SQLiteCache` with a size limit on the stored responses."""
+
+    def __init__(self, db_path, max_size=None, eviction='lru', serializer=None, refresh_interval=None, **kwargs):
+        BaseCache.__init__(self, cache_name=str(db_path), **kwargs)
+        skwargs = dict(kwargs, serializer=serializer) if serializer else kwargs
+        self.responses = BoundedSQLiteDict(db_path, table_name='responses', max_size=max_size, eviction=eviction,
+                                           refresh_interval=refresh_interval, **skwargs)
+        self.redirects = SQLiteDict(db_path, table_name='redirects', lock=self.responses._lock, serializer=None,
+                                    **kwargs)
+
+    def _delete_expired(self):
+        if isinstance(self.responses, WriteBehindStorage):
+            self.responses.flush()
+        super(BoundedSQLiteCache, self)._delete_expired()
+        self.responses.reset_index()
+
+
+class BoundedFileCache(FileCache):
+    """`requests_cache.FileCache` (one file per response in a directory) with a size limit."""
+
+    def __init__(self, cache_name, max_size=None, eviction='lru', refresh_interval=None, **kwargs):
+        BaseCache.__init__(self, cache_name=str(cache_name), **kwargs)
+        self.responses = BoundedFileDict(cache_name, max_size=max_size, eviction=eviction, decode_content=True,
+                                         refresh_interval=refresh_interval, **kwargs)
+        with self.lock:
+            self.redirects = SQLiteDict(os.path.join(str(self.cache_dir), 'redirects.sqlite'), 'redirects',
+                                        serializer=None, **kwargs)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def create_cache(backend, path, max_size=None, eviction='lru', fast_save=False, serializer=None, wal=False,
+                 busy_timeout=None, refresh_interval=None, write_behind=None):
+    """
+    Creates the cache for one of the `BACKENDS`; `path` is the sqlite file or the directory for `filesystem`.
+    `serializer` applies to the sqlite and memory backends, the filesystem one keeps readable JSON files.
+
+    The sqlite and filesystem caches can be shared by several processes. With `wal` the sqlite file uses
+    write-ahead logging, so readers never wait for a writer and writers only wait for each other for the duration
+    of one insert; `busy_timeout` is how long (in ms) a writer waits for the lock before giving up.
+    `refresh_interval` is how often the size statistics are merged with what other processes stored.
+
+    `write_behind` is a dict of `WriteBehindStorage` arguments, to write the responses of the sqlite and filesystem
+    caches in the background.
+    """
+    assert backend in BACKENDS, 'Unknown cache backend {0}, use one of {1}'.format(backend, ', '.join(BACKENDS))
+    if backend == 'memory':
+        return MemoryCache(max_size=max_size, eviction=eviction, serializer=serializer or 'pickle')
+    if backend == 'filesystem':
+        cache = BoundedFileCache(path, max_size=max_size, eviction=eviction, refresh_interval=refresh_interval)
+    else:
+        cache = BoundedSQLiteCache(path, max_size=max_size, eviction=eviction, fast_save=fast_save,
+                                   serializer=serializer, wal=wal, busy_timeout=busy_timeout,
+                                   refresh_interval=refresh_interval)
+    if write_behind is not None:
+        cache.responses = WriteBehindStorage(cache.responses, **write_behind)
+    return cache
+
+#-----------------------------------------------------------------------------------------------------------------------
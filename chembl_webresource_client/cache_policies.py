@@ -0,0 +1,68 @@
+"""
+`Settings.CACHE_POLICIES` maps resource names (and `search`, which applies to the search endpoints of all
+resources) to a dict with any of these keys:
+
+    expire: how long responses are cached, in seconds, -1 for ever (`CACHE_EXPIRE` by default)
+    cache: False to never cache responses
+    object_cache: False to keep responses out of the in-process object, record and negative caches, so they're
+        only cached by the HTTP cache
+    max_entry_size: responses bigger than this many bytes aren't cached
+    compress: False to store responses uncompressed even if `CACHE_COMPRESSION` is set
+    backend: cache backend used for the resource, so e.g. bulk image downloads can't evict other responses
+"""
+
+import re
+from collections import OrderedDict
+from urllib.parse import urlparse
+from chembl_webresource_client.settings import Settings
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def _data_path():
+    return urlparse(Settings.Instance().NEW_CLIENT_URL).path.rstrip('/') + '/'
+
+
+def resource_from_url(url):
+    """Returns (resource name, whether it's a search) for a data web services url, (None, False) for other urls."""
+    parsed = urlparse(url)
+    if parsed.netloc != urlparse(Settings.Instance().NEW_CLIENT_URL).netloc or \
+            not parsed.path.startswith(_data_path()):
+        return None, False
+    parts = parsed.path[len(_data_path()):].split('/')
+    return parts[0].split('.')[0], len(parts) > 1 and parts[1].split('.')[0] == 'search'
+
+
+def get_cache_policy(resource, search=False):
+    policies = Settings.Instance().CACHE_POLICIES or {}
+    policy = dict(policies.get(resource, {}))
+    if search:
+        policy.update(policies.get('search', {}))
+    return policy
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def urls_expire_after():
+    """Per resource expiration patterns for `requests_cache`; the search ones come first as they're more specific."""
+    base = re.escape(Settings.Instance().NEW_CLIENT_URL.split('://')[-1].rstrip('/') + '/')
+    patterns = OrderedDict()
+    for resource, policy in sorted((Settings.Instance().CACHE_POLICIES or {}).items(), key=lambda p: p[0] != 'search'):
+        if 'expire' not in policy:
+            continue
+        if resource == 'search':
+            patterns[re.compile(base + r'[^/?]+/search([./?]|$)')] = policy['expire']
+        else:
+            patterns[re.compile(base + re.escape(resource) + r'([./?]|$)')] = policy['expire']
+    return patterns
+
+
+def filter_response(response):
+    """Tells `requests_cache` whether the response may be cached according to the policy of its resource."""
+    policy = get_cache_policy(*resource_from_url(response.url))
+    if not policy.get('cache', True):
+        return False
+    max_entry_size = policy.get('max_entry_size')
+    return max_entry_size is None or len(response.content) <= max_entry_size
+
+#-----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,117 @@
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from urllib.parse import urlparse
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+
+_pending = {}
+_lock = threading.Lock()
+
+# pending statistics are written once they cover that many cache entries, so long running processes don't grow
+MAX_PENDING_ENTRIES = 10000
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def get_stats_path(backend=None):
+    from chembl_webresource_client.session import get_cache_path
+    return get_cache_path(backend) + '.stats'
+
+
+def resource_label(url):
+    """Name of the resource a cached url belongs to, the host for urls other than the data web services."""
+    from chembl_webresource_client.cache_policies import resource_from_url
+    resource, search = resource_from_url(url)
+    if resource is None:
+        return urlparse(url).netloc or 'other'
+    return resource + ('/search' if search else '')
+
+
+def _connect(path):
+    con = sqlite3.connect(path, timeout=30)
+    con.execute('CREATE TABLE IF NOT EXISTS resources (resource TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)')
+    con.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, hits INTEGER, last_used REAL)')
+    return con
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def stats_hook(backend=None):
+    """
+    Returns a response hook for cached sessions counting cache hits and misses per resource and when every cache
+    entry was last used. The counts are kept in memory and added to a small sqlite database next to the cache
+    (`<cache>.stats`) by `flush`, which `close_sessions` calls. The `chembl_cache` script reports them and uses
+    them to keep the entries used most recently (or most often) when it shrinks the cache. Only requests reaching
+    the HTTP cache are counted, not those answered by the in-process caches of `object_cache`.
+    """
+    path = get_stats_path(backend)
+
+    def hook(response, *args, **kwargs):
+        key = getattr(response, 'cache_key', None)
+        if key is None or not getattr(response, 'url', None):
+            return response
+        hit = bool(getattr(response, 'from_cache', False))
+        with _lock:
+            resources, entries = _pending.setdefault(path, ({}, {}))
+            counts = resources.setdefault(resource_label(response.url), [0, 0])
+            counts[0 if hit else 1] += 1
+            entry = entries.setdefault(key, [0, 0])
+            entry[0] += hit
+            entry[1] = time.time()
+            full = len(entries) >= MAX_PENDING_ENTRIES
+        if full:
+            flush()
+        return response
+
+    return hook
+
+
+def flush():
+    """Adds the statistics gathered by the hooks to the statistics databases."""
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    for path, (resources, entries) in pending.items():
+        try:
+            with closing(_connect(path)) as con, con:
+                con.executemany('INSERT INTO resources VALUES (?, ?, ?) ON CONFLICT(resource) DO UPDATE SET '
+                                'hits = hits + excluded.hits, misses = misses + excluded.misses',
+                                [(resource, hits, misses) for resource, (hits, misses) in resources.items()])
+                con.executemany('INSERT INTO entries VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET '
+                                'hits = hits + excluded.hits, last_used = MAX(last_used, excluded.last_used)',
+                                [(key, hits, last_used) for key, (hits, last_used) in entries.items()])
+        except sqlite3.Error as e:
+            logger.warning('Could not save the cache statistics to {0}: {1}'.format(path, e))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def read_stats(backend=None):
+    """Returns ({resource: (hits, misses)}, {cache key: (hits, last used)}) recorded for the cache."""
+    flush()
+    with closing(_connect(get_stats_path(backend))) as con:
+        resources = dict((row[0], tuple(row[1:])) for row in con.execute('SELECT * FROM resources'))
+        entries = dict((row[0], tuple(row[1:])) for row in con.execute('SELECT * FROM entries'))
+    return resources, entries
+
+
+def forget_entries(keys, backend=None):
+    """Drops the statistics of cache entries that were deleted."""
+    flush()
+    with closing(_connect(get_stats_path(backend))) as con, con:
+        con.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in keys])
+
+
+def clear_stats(backend=None):
+    with _lock:
+        _pending.pop(get_stats_path(backend), None)
+    with closing(_connect(get_stats_path(backend))) as con, con:
+        con.execute('DELETE FROM resources')
+        con.execute('DELETE FROM entries')
+
+#-----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,137 @@
+import zlib
+import logging
+from chembl_webresource_client.settings import Settings
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+MAGIC = b'\x00CWC'
+METHODS = {b'z': 'zlib', b's': 'zstd'}
+SERIALIZER_NAME = 'pickle+compression'
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+def compress(data, method='zlib', level=None):
+    """Compresses `data` prefixed with a header naming the method, so `decompress` can tell how to read it."""
+    if method == 'zstd':
+        zstandard = _zstd()
+        if zstandard is not None:
+            return MAGIC + b's' + zstandard.ZstdCompressor(level=level or 3).compress(data)
+        logger.warning('zstandard is not installed, using zlib compression instead')
+    return MAGIC + b'z' + zlib.compress(data, 6 if level is None else level)
+
+
+def decompress(data):
+    """Returns `data` decompressed, or as it is if it wasn't compressed by `compress`."""
+    if not isinstance(data, bytes) or not data.startswith(MAGIC):
+        return data
+    method, payload = data[len(MAGIC):len(MAGIC) + 1], data[len(MAGIC) + 1:]
+    if method == b'z':
+        return zlib.decompress(payload)
+    if method == b's' and _zstd() is not None:
+        return _zstd().ZstdDecompressor().decompress(payload)
+    # requests_cache treats ValueErrors while deserializing as a cache miss
+    raise ValueError('Cannot decompress cached response compressed with {0}'.format(METHODS.get(method, method)))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class CompressionStage(object):
+    """
+    `requests_cache` serializer stage compressing the body of responses of at least `threshold` bytes. It runs on
+    the unstructured response, so the url is known and the `compress` flag of the resource cache policy can be
+    honoured. Bodies stored without compression are read as they are, so existing caches keep working.
+    """
+
+    def __init__(self, method=None, threshold=0, level=None):
+        self.method = method
+        self.threshold = threshold
+        self.level = level
+
+    def dumps(self, obj):
+        from chembl_webresource_client.cache_policies import get_cache_policy, resource_from_url
+        content = obj.get('_content') if isinstance(obj, dict) else None
+        if self.method and isinstance(content, bytes) and len(content) >= self.threshold and \
+                get_cache_policy(*resource_from_url(obj.get('url', ''))).get('compress', True):
+            obj['_content'] = compress(content, self.method, self.level)
+        return obj
+
+    def loads(self, obj):
+        if isinstance(obj, dict) and '_content' in obj:
+            obj['_content'] = decompress(obj['_content'])
+        return obj
+
+    def copy(self):
+        return self.__class__(self.method, self.threshold, self.level)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def get_serializer(method=None, threshold=None, level=None):
+    """
+    Returns the pickle based serializer used by the sqlite and memory caches, compressing response bodies as set
+    by `Settings.CACHE_COMPRESSION`, `CACHE_COMPRESSION_THRESHOLD` and `CACHE_COMPRESSION_LEVEL`.
+    `requests_cache` makes the serializer part of the cache keys. Its name doesn't depend on the compression
+    settings, as any of them can read what the others wrote, so changing them doesn't invalidate the cache.
+    """
+    from requests_cache.serializers import SerializerPipeline, pickle_serializer
+    s = Settings.Instance()
+    method = s.CACHE_COMPRESSION if method is None else method
+    threshold = s.CACHE_COMPRESSION_THRESHOLD if threshold is None else threshold
+    level = s.CACHE_COMPRESSION_LEVEL if level is None else level
+    unstructure, pickle_stage = pickle_serializer.stages
+    return SerializerPipeline([unstructure.copy() if hasattr(unstructure, 'copy') else unstructure,
+                               CompressionStage(method, threshold, level), pickle_stage],
+                              name=SERIALIZER_NAME, is_binary=True)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def compress_cache(cache):
+    """
+    Rewrites every response stored in `cache` with its current serializer, so a cache filled before compression
+    was enabled (or with other compression settings) takes advantage of them. Responses stored by a client using
+    the plain `requests_cache` serializer are moved to the keys they have with the current one. Returns the number
+    of responses.
+    """
+    responses = cache.responses
+    count = 0
+    commit = getattr(responses, 'bulk_commit', None)
+    keys = list(responses.keys())
+    for start in range(0, len(keys), 500):
+        if commit is not None:
+            with commit():
+                count += _rewrite(cache, keys[start:start + 500])
+        else:
+            count += _rewrite(cache, keys[start:start + 500])
+    if hasattr(responses, 'vacuum'):
+        responses.vacuum()
+    return count
+
+
+def _rewrite(cache, keys):
+    responses = cache.responses
+    count = 0
+    for key in keys:
+        response = responses.get(key)
+        if response is None:
+            continue
+        # the client's sessions always match headers, so build the key the same way
+        new_key = cache.create_key(response.request, match_headers=True) if response.request else key
+        responses[new_key] = response
+        if new_key != key:
+            del responses[key]
+        count += 1
+    return count
+
+#-----------------------------------------------------------------------------------------------------------------------
@@ -8,6 +8,9 @@ class ElasticClient(Query):
     def __init__(self):
         super(ElasticClient, self).__init__()
 
+    def _session_url(self):
+        return Settings.Instance().ELASTIC_URL
+
     def _search(self, query, method_name):
         url = '{0}/{1}/_search'.format(Settings.Instance().ELASTIC_URL, method_name)
         res = self.session.post(url, data=
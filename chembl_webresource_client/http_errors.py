@@ -114,3 +114,15 @@ def handle_http_error(request):
         raise exception_class(request.url, request.content)
 
 #-----------------------------------------------------------------------------------------------------------------------
+
+def is_not_found(error):
+    """
+    Tells whether `error` means the requested resource doesn't exist: a 404 response, or the sessions giving up
+    retrying a request that kept getting 404 responses.
+    """
+    if isinstance(error, HttpNotFound):
+        return True
+    from requests.exceptions import RetryError
+    return isinstance(error, RetryError) and 'too many 404 error responses' in str(error)
+
+#-----------------------------------------------------------------------------------------------------------------------
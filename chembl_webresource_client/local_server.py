@@ -0,0 +1,206 @@
+import json
+import time
+import threading
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+API_PATH = '/chembl/api/data'
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def make_dataset(activities=1000, molecules=100):
+    """Builds a small synthetic data set resembling the ChEMBL activity, molecule and source resources."""
+    molecule = [{'molecule_chembl_id': 'CHEMBL{0}'.format(i),
+                 'pref_name': 'MOLECULE {0}'.format(i),
+                 'molecule_structures': {'canonical_smiles': 'C' * (i % 10 + 1)}} for i in range(1, molecules + 1)]
+    activity = [{'activity_id': i,
+                 'molecule_chembl_id': 'CHEMBL{0}'.format(i % molecules + 1),
+                 'target_chembl_id': 'CHEMBL{0}'.format(1000 + i % 7),
+                 'standard_type': ('IC50', 'Ki', 'EC50')[i % 3],
+                 'standard_value': str(float(i % 50))} for i in range(1, activities + 1)]
+    source = [{'src_id': i, 'src_short_name': 'SOURCE{0}'.format(i)} for i in range(1, 11)]
+    return {
+        'activity': {'collection_name': 'activities', 'pk': 'activity_id', 'records': activity},
+        'molecule': {'collection_name': 'molecules', 'pk': 'molecule_chembl_id', 'records': molecule},
+        'source': {'collection_name': 'sources', 'pk': 'src_id', 'records': source},
+    }
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def make_schema(resources):
+    """Builds a minimal SPORE description listing the given resources."""
+    methods = {}
+    for name, resource in resources.items():
+        methods['GET_{0}_dispatch_detail'.format(name)] = {
+            'method': 'GET',
+            'path': '/{0}/:{1}'.format(name, resource['pk']),
+            'resource_name': name,
+            'collection_name': resource['collection_name'],
+            'formats': ['json', 'jsonp', 'xml'],
+            'default_format': 'application/json',
+        }
+    return {'name': 'ChEMBL API stand-in', 'methods': methods}
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def _matches(record, key, value):
+    field, _, lookup = key.partition('__')
+    actual = record.get(field)
+    if lookup == 'in':
+        values = value if isinstance(value, list) else unquote(str(value)).split(',')
+        return str(actual) in [str(v) for v in values]
+    if isinstance(value, str):
+        value = unquote(value)
+    if lookup in ('gt', 'gte', 'lt', 'lte'):
+        value = type(actual)(value)
+        return {'gt': actual > value, 'gte': actual >= value, 'lt': actual < value, 'lte': actual <= value}[lookup]
+    return str(actual) == str(value)
+
+
+def _sort_key(value):
+    # like the decimal columns of the web services, numbers serialised as strings sort as numbers
+    try:
+        return 0, float(value), ''
+    except (TypeError, ValueError):
+        return 1, 0, str(value)
+
+
+def _filter(records, key, value):
+    field, _, lookup = key.partition('__')
+    if lookup == 'in':
+        values = value if isinstance(value, list) else unquote(str(value)).split(',')
+        values = set(str(v) for v in values)
+        return [r for r in records if str(r.get(field)) in values]
+    return [r for r in records if _matches(r, key, value)]
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, content_type='application/json', headers=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _resource(self, path):
+        name = path[len(API_PATH) + 1:].split('/')[0].split('.')[0]
+        return name, self.server.resources.get(name)
+
+    def do_GET(self):
+        server = self.server
+        server.record(self.command, self.path)
+        path = self.path.split('?')[0]
+        if path == API_PATH + '/spore':
+            etag = '"{0}"'.format(server.release)
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, b'', headers={'ETag': etag})
+            return self._send(200, make_schema(server.resources), headers={'ETag': etag})
+        if path in (API_PATH + '/status', API_PATH + '/status.json'):
+            return self._send(200, {'chembl_db_version': server.release, 'status': 'UP'})
+        name, resource = self._resource(path)
+        if not resource:
+            return self._send(404, {'error_message': 'No such resource'})
+        parts = path[len(API_PATH) + 1:].split('/')
+        by_pk = {str(r[resource['pk']]): r for r in resource['records']}
+        if len(parts) == 3 and parts[1] == 'set':
+            ids = [unquote(i) for i in parts[2].split(';')]
+            return self._send(200, {resource['collection_name']: [by_pk[i] for i in ids if i in by_pk]})
+        if len(parts) == 2:
+            record = by_pk.get(unquote(parts[1]).split('.')[0])
+            if record is None:
+                return self._send(404, {'error_message': 'Not found'})
+            return self._send(200, record)
+        return self._send(400, {'error_message': 'Unsupported request'})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        server.record(self.command, self.path, body)
+        if server.latency:
+            time.sleep(server.latency)
+        name, resource = self._resource(self.path)
+        if not resource:
+            return self._send(404, {'error_message': 'No such resource'})
+        params = json.loads(body.decode('utf-8')) if body else []
+        limit, offset, ordering, only = 20, 0, [], []
+        records = resource['records']
+        for key, value in params:
+            if key == 'q':
+                # full text search, every record containing the query scores the same
+                query = unquote(value).lower()
+                records = [dict(r, score=1.0) for r in records if query in json.dumps(r).lower()]
+            elif key == 'limit':
+                limit = int(value)
+            elif key == 'offset':
+                offset = int(value)
+            elif key == 'order_by':
+                ordering.append(value)
+            elif key == 'only':
+                only.append(value)
+            else:
+                records = _filter(records, key, value)
+        for field in reversed(ordering):
+            records = sorted(records, key=lambda r: _sort_key(r[field.lstrip('-')]), reverse=field.startswith('-'))
+        page = records[offset:offset + limit]
+        if only:
+            page = [{k: v for k, v in r.items() if k in only} for r in page]
+        return self._send(200, {resource['collection_name']: page,
+                                'page_meta': {'limit': limit, 'offset': offset, 'total_count': len(records)}})
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the ChEMBL data web services, used by tests and benchmarks that must run without network.
+    It understands the subset of the REST API used by `UrlQuery`: filtered, ordered and paginated list requests
+    (POSTed with the `X-HTTP-Method-Override` header), searches, single resources, `/set/` requests, `spore` and
+    `status`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, resources=None, latency=0.0, release='ChEMBL_99'):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.resources = resources if resources is not None else make_dataset()
+        self.latency = latency
+        self.release = release
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}{1}'.format(self.server_address[1], API_PATH)
+
+    def record(self, method, path, body=None):
+        with self.lock:
+            self.requests.append((method, path, body))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+#-----------------------------------------------------------------------------------------------------------------------
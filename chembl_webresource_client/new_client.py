@@ -1,7 +1,7 @@
 __author__ = 'mnowotka'
 
 from urllib.parse import urlparse
-import requests
+from chembl_webresource_client.schema_cache import load_schema, DATA_SPORE
 from chembl_webresource_client.query_set import QuerySet
 from chembl_webresource_client.query_set import Model
 from chembl_webresource_client.settings import Settings
@@ -10,22 +10,53 @@ from easydict import EasyDict
 #-----------------------------------------------------------------------------------------------------------------------
 
 class NewClient(object):
-    pass
+    """
+    Exposes every resource described by the SPORE schema as an attribute. The resource table is computed once
+    from the schema; the `QuerySet` (and its `UrlQuery`) for a resource is only created when it's first accessed.
+    """
+
+    def __init__(self):
+        self._resources = {}
+        self.cache_backend = None
+
+    def __getattr__(self, name):
+        resources = self.__dict__.get('_resources', {})
+        if name not in resources:
+            raise AttributeError("'{0}' object has no attribute '{1}'".format(self.__class__.__name__, name))
+        resource = self._make_resource(*resources[name])
+        setattr(self, name, resource)
+        return resource
+
+    def __dir__(self):
+        return sorted(set(dir(self.__class__)) | set(self.__dict__) | set(self._resources))
+
+    def _make_resource(self, model, default_format):
+        qs = QuerySet(model=model)
+        if self.cache_backend:
+            qs.query.cache_backend = self.cache_backend
+        if default_format not in ('xml', 'svg+xml'):
+            qs.set_format(default_format)
+        return qs
+
+    def using(self, backend):
+        """Returns a client for the same resources, caching responses with another backend"""
+        return client_from_schema(self.description, client_class=self.__class__, cache_backend=backend)
+
+    @property
+    def resources(self):
+        return sorted(self._resources)
 
 #-----------------------------------------------------------------------------------------------------------------------
 
-def client_from_url(url, base_url=None):
+def client_from_url(url, base_url=None, fallback=None):
     """Builds a client from an url
 
     :param url: the url you want to get the SPORE schema from
-    :param session: the :class:`request.Session` instance to use. Defaults to
-                    the requests module itself.
+    :param fallback: name of the bundled schema to use if it can't be
+                     fetched and wasn't persisted before.
 
     """
-    res = requests.get(url)
-    if not res.ok:
-        raise Exception('Error getting schema from url {0} with status {1} and msg {2}'.format(url, res.status_code, res.text))
-    schema = res.json()
+    schema = load_schema(url, fallback=fallback)
     if 'base_url' not in schema:
         if base_url:
             schema['base_url'] = base_url
@@ -34,13 +65,30 @@ def client_from_url(url, base_url=None):
             schema['base_url'] = parsed_url.scheme + '://' + parsed_url.netloc + '/'
     if not schema['base_url'].endswith('/'):
         schema['base_url'] += '/'
+    return client_from_schema(schema)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+def client_from_schema(schema, client_class=NewClient, cache_backend=None):
+    """Builds a client from an already fetched SPORE schema"""
 
-    client = NewClient()
+    client = client_class()
+    client.cache_backend = cache_backend
     client.description = EasyDict(schema)
     client.official = False # TODO: change
 
-    keys = client.description.methods.keys()
-    for method, definition in [(m,d) for (m,d) in client.description.methods.items() if
+    for name, model, default_format in resources_from_schema(client.description):
+        client._resources[name] = (model, default_format)
+
+    return client
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+def resources_from_schema(description):
+    """Yields a (name, model, default format) tuple for every resource described by the SPORE schema"""
+
+    keys = description.methods.keys()
+    for method, definition in [(m,d) for (m,d) in description.methods.items() if
                                (m.startswith('POST_') or m.startswith('GET_')) and m.endswith('_detail')]:
         searchable = False
         if method.replace('dispatch_detail', 'get_search') in keys:
@@ -51,17 +99,24 @@ def client_from_url(url, base_url=None):
         default_format = definition['default_format'].split('/')[-1]
         if not name:
             continue
-        model = Model(name, collection_name, formats, searchable)
-        qs = QuerySet(model=model)
-        if default_format not in ('xml', 'svg+xml'):
-            qs.set_format(default_format)
-        setattr(client, name, qs)
+        yield name, Model(name, collection_name, formats, searchable, primary_key(definition)), default_format
 
-    return client
+#-----------------------------------------------------------------------------------------------------------------------
+
+def primary_key(definition):
+    """Name of the primary key field of a resource, when its detail path names it (e.g. `/source/:src_id`)"""
+
+    last = definition.get('path', '').rstrip('/').split('/')[-1]
+    if last.startswith(':') and last != ':pk':
+        return last[1:]
 
 
 #-----------------------------------------------------------------------------------------------------------------------
 
-new_client = client_from_url(Settings.Instance().NEW_CLIENT_URL + '/spore')
+def __getattr__(name):
+    if name == 'new_client':
+        globals()[name] = client_from_url(Settings.Instance().NEW_CLIENT_URL + '/spore', fallback=DATA_SPORE)
+        return globals()[name]
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
 
 #-----------------------------------------------------------------------------------------------------------------------
\ No newline at end of file
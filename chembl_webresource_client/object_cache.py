@@ -0,0 +1,132 @@
+import time
+import pickle
+import threading
+from collections import OrderedDict
+from chembl_webresource_client.settings import Settings
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class ObjectCache(object):
+    """
+    In-process LRU cache of already decoded responses (pages of records, single records, `/set` results), in front
+    of the HTTP cache, so repeating a query doesn't cost a cache lookup, deserialization and JSON parsing again.
+    Entries are keyed by the request that produced them and weighted by the size of the response body; the total
+    is kept under `max_size` bytes and entries older than `expire` seconds are ignored. With `copy` the objects
+    are stored pickled and every hit gets its own copy, so callers can modify what they get without affecting
+    later lookups; unpickling is still several times faster than decoding the response again.
+    """
+
+    def __init__(self, max_size=None, expire=None, copy=False):
+        self.max_size = max_size
+        self.expire = expire
+        self.copy = copy
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            expire = self.expire if entry is None or entry[3] is None else entry[3]
+            if entry is not None and expire is not None and 0 <= expire < time.time() - entry[2]:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            value = entry[0]
+        return pickle.loads(value) if self.copy else value
+
+    def put(self, key, value, size, expire=None):
+        """Caches `value`, for `expire` seconds instead of the default of the cache if given (-1 for ever)."""
+        if self.copy:
+            value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if self.max_size is not None and size > self.max_size:
+                return
+            self.entries[key] = (value, size, time.time(), expire)
+            self.size += size
+            while self.max_size is not None and self.size > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'size': self.size, 'max_size': self.max_size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+object_cache = ObjectCache(copy=True)
+record_cache = ObjectCache(copy=True)
+negative_cache = ObjectCache()
+
+
+def _configured(cache, max_size, expire=None):
+    s = Settings.Instance()
+    if not s.CACHING or not max_size:
+        return None
+    cache.max_size = max_size
+    cache.expire = s.CACHE_EXPIRE if expire is None else expire
+    return cache
+
+
+def get_object_cache():
+    """Returns the process wide cache of decoded responses configured from `Settings`, or None if it's disabled."""
+    return _configured(object_cache, Settings.Instance().OBJECT_CACHE_MAX_SIZE)
+
+
+def get_record_cache():
+    """
+    Returns the process wide cache of single records keyed by (resource url, primary key), filled from every
+    page, `/set` and single record response, or None if it's disabled.
+    """
+    return _configured(record_cache, Settings.Instance().RECORD_CACHE_MAX_SIZE)
+
+
+def get_negative_cache():
+    """
+    Returns the process wide cache of lookups that found nothing (404 responses, ids missing from `/set`
+    responses, empty results), kept for `NEGATIVE_CACHE_EXPIRE` seconds, or None if it's disabled.
+    """
+    s = Settings.Instance()
+    if not s.NEGATIVE_CACHE_EXPIRE:
+        return None
+    return _configured(negative_cache, s.NEGATIVE_CACHE_MAX_SIZE, s.NEGATIVE_CACHE_EXPIRE)
+
+
+def _copy_error(error):
+    # a copy without the traceback (or the connection pool of a RetryError), so they aren't kept alive
+    if hasattr(error, 'url') and hasattr(error, 'content'):
+        return error.__class__(error.url, error.content)
+    return error.__class__(str(error))
+
+
+def remember_not_found(cache, key, error):
+    cache.put(key, _copy_error(error), len(str(error)))
+
+
+def check_negative(cache, key):
+    """Raises the error remembered for `key` by `remember_not_found`, or returns the empty result remembered for it."""
+    value = cache.get(key) if cache is not None else None
+    if isinstance(value, Exception):
+        raise _copy_error(value)
+    return value
+
+#-----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,189 @@
+"""
+Caching proxy for the ChEMBL data web services, so a group of users or jobs shares one warm cache instead of each
+keeping its own copy of the same data. The proxy speaks the same REST paths as the web services: clients simply
+point `Settings.NEW_CLIENT_URL` at it. Responses are served from the cache of the proxy when possible, identical
+requests arriving while the first one is still in progress wait for its response instead of going to the web
+services again, and all requests to the web services share one pool of keep-alive connections.
+"""
+
+import json
+import logging
+import threading
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from chembl_webresource_client.settings import Settings
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+# only these request headers are passed on, so requests from different clients (e.g. with different user agents)
+# map to the same cache entries
+FORWARDED_HEADERS = ('Accept', 'Content-Type', 'X-HTTP-Method-Override')
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class _Call(object):
+    """A request to the web services in progress, which identical requests wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+
+    # keep-alive connections for the clients too
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _proxy(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        if not self.path.startswith(server.path + '/'):
+            error = {'error_message': 'Only {0} is proxied'.format(server.path)}
+            return self._send(404, json.dumps(error).encode('utf-8'))
+        headers = dict((header, self.headers[header]) for header in FORWARDED_HEADERS if header in self.headers)
+        try:
+            (status, content_type, content), source = server.fetch(self.command, self.path, body, headers)
+        except Exception as e:
+            logger.warning('Request to {0} failed: {1}'.format(server.upstream + self.path[len(server.path):], e))
+            error = {'error_message': 'The web services could not be reached: {0}'.format(e)}
+            return self._send(502, json.dumps(error).encode('utf-8'))
+        self._send(status, content, content_type, {'X-Cache': source})
+
+    do_GET = _proxy
+    do_POST = _proxy
+    do_HEAD = _proxy
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+class CachingProxy(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP server forwarding the requests it receives under the path of `upstream` (`Settings.NEW_CLIENT_URL`
+    by default) to `upstream` through a cached session using `backend` (`Settings.CACHE_BACKEND` by default), so
+    the proxy caches responses even if `Settings.CACHING` is off. Transient server errors are retried as usual,
+    other errors are passed on to the clients as they are. The `X-Cache` response header tells whether a response
+    came from the cache (HIT), the web services (MISS) or a concurrent identical request (COALESCED).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, upstream=None, host='127.0.0.1', port=0, backend=None):
+        HTTPServer.__init__(self, (host, port), _ProxyHandler)
+        self.upstream = (upstream or Settings.Instance().NEW_CLIENT_URL).rstrip('/')
+        self.path = urlparse(self.upstream).path
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self._calls = {}
+        self._session = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{0}:{1}{2}'.format(host, port, self.path)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'in_progress': len(self._calls)}
+
+    def _get_session(self):
+        from urllib3.util import Retry
+        from chembl_webresource_client.session import _create_session
+        with self.lock:
+            if self._session is None:
+                s = Settings.Instance()
+                retry = Retry(total=s.TOTAL_RETRIES, backoff_factor=s.BACKOFF_FACTOR,
+                              status_forcelist=list(range(500, 505)), raise_on_status=False)
+                self._session = _create_session({}, self.backend, caching=True, retry=retry)
+            return self._session
+
+    def fetch(self, method, path, body, headers):
+        """
+        Returns ((status, content type, content), source) for a request, performing it only if no identical request
+        is in progress already.
+        """
+        key = (method, path, body, tuple(sorted(headers.items())))
+        with self.lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            with self.lock:
+                self.coalesced += 1
+            return call.response, 'COALESCED'
+        try:
+            res = self._forward(method, path, body, headers)
+            call.response = (res.status_code, res.headers.get('Content-Type', 'application/json'), res.content)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self._calls[key]
+            call.done.set()
+        hit = getattr(res, 'from_cache', False)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return call.response, 'HIT' if hit else 'MISS'
+
+    def _forward(self, method, path, body, headers):
+        from requests_cache import DO_NOT_CACHE
+        from chembl_webresource_client.release import check_release
+        s = Settings.Instance()
+        if self.upstream == s.NEW_CLIENT_URL.rstrip('/'):
+            check_release(self.backend)
+        url = self.upstream + path[len(self.path):]
+        kwargs = {}
+        if urlparse(path).path.rstrip('/').split('/')[-1] in ('status', 'status.json'):
+            # the release reported by the web services is what tells clients when to clear their own cache
+            kwargs['expire_after'] = DO_NOT_CACHE
+        return self._get_session().request(method if method != 'HEAD' else 'GET', url, data=body or None,
+                                           headers=headers, timeout=s.NEW_CLIENT_TIMEOUT, **kwargs)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._session is not None:
+            # only the connection pool, the cache is shared with the sessions of the process
+            import requests
+            requests.Session.close(self._session)
+
+#-----------------------------------------------------------------------------------------------------------------------
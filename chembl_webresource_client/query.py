@@ -1,36 +1,20 @@
-from chembl_webresource_client.settings import Settings
-import os, os.path
-import requests
-import requests_cache
-from requests.packages.urllib3.util import Retry
+from chembl_webresource_client.session import get_session
 
 
 class Query(object):
 
+    headers = {"X-HTTP-Method-Override": "GET", 'Content-type': 'application/json'}
+    cache_backend = None
+
     def __init__(self):
-        self.session = None
-        self._get_session()
+        pass
+
+    def _session_url(self):
+        return getattr(self, 'base_url', None)
 
     def _get_session(self):
-        s = Settings.Instance()
-        if not self.session:
-            retry = Retry(total=s.TOTAL_RETRIES, backoff_factor=s.BACKOFF_FACTOR,
-                          status_forcelist=(list(range(400, 421)) + list(range(500, 505))))
-            size = s.CONCURRENT_SIZE
-            adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size,
-                                                    pool_block=True, max_retries=retry)
-            home_directory = os.path.expanduser('~')
-            self.session = requests_cache.CachedSession(
-                os.path.join(home_directory, s.CACHE_NAME),
-                backend='sqlite',
-                expire_after=s.CACHE_EXPIRE,
-                fast_save=s.FAST_SAVE,
-                allowable_methods=('GET', 'POST'),
-                include_get_headers=True) if s.CACHING else requests.Session()
-            if s.PROXIES:
-                self.session.proxies = s.PROXIES
-            self.session.headers.update({"X-HTTP-Method-Override": "GET"})
-            self.session.headers.update({'Content-type': 'application/json'})
-            self.session.mount('http://', adapter)
-            self.session.mount('https://', adapter)
-        return self.session
+        return get_session(self._session_url(), self.headers, self.cache_backend)
+
+    @property
+    def session(self):
+        return self._get_session()
@@ -9,11 +9,12 @@ from chembl_webresource_client.url_query import UrlQuery
 #-----------------------------------------------------------------------------------------------------------------------
 
 class Model(object):
-    def __init__(self, name, collection_name = None, formats=('json', 'xml'), searchable=False):
+    def __init__(self, name, collection_name = None, formats=('json', 'xml'), searchable=False, pk=None):
         self.name = name
         self.collection_name = collection_name
         self.formats = formats
         self.searchable=searchable
+        self.pk = pk
 
 #This class is based on Django QuerySet (https://github.com/django/django/blob/master/django/db/models/query.py)
 
@@ -99,6 +100,8 @@ class QuerySet(object):
 #-----------------------------------------------------------------------------------------------------------------------
 
     def __iter__(self):
+        if self.query.adaptive_page_size or self.query.keyset:
+            return self.iterator()
         self.chunk = None
         self.current_index = 0
         self.query.__iter__()
@@ -126,6 +129,44 @@ class QuerySet(object):
     def __next__(self):
         return self.next()
 
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def iterator(self, workers=None, window=None):
+        if not self.query.allows_multiple:
+            return iter(())
+        return self.query.clone().iterate(workers=workers, window=window)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def keyset(self, field, after=None):
+        assert not self.searched, "Cannot use keyset pagination on search results"
+        if not self.query.allows_multiple:
+            return None
+        clone = self._clone()
+        clone.query.set_keyset(field, after)
+        return clone
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def page_size(self, size):
+        clone = self._clone()
+        clone.query.set_page_size(size)
+        return clone
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def using(self, backend):
+        clone = self._clone()
+        clone.query.cache_backend = backend
+        return clone
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+    def read_ahead(self, pages=1):
+        clone = self._clone()
+        clone.query.read_ahead = pages
+        return clone
+
 #-----------------------------------------------------------------------------------------------------------------------
 
     def __bool__(self):
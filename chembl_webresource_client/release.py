@@ -0,0 +1,92 @@
+import time
+import logging
+import threading
+from chembl_webresource_client.settings import Settings
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+logger = logging.getLogger(__name__)
+
+_checked = {}
+_releases = {}
+_lock = threading.Lock()
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def get_release_marker_path(backend=None):
+    from chembl_webresource_client.session import get_cache_path
+    return get_cache_path(backend) + '.release'
+
+
+def read_release_marker(backend=None):
+    try:
+        with open(get_release_marker_path(backend)) as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def write_release_marker(release, backend=None):
+    try:
+        with open(get_release_marker_path(backend), 'w') as f:
+            f.write(release)
+    except (IOError, OSError) as e:
+        logger.warning('Could not record the ChEMBL release of the cache: {0}'.format(e))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def fetch_release():
+    """Returns the ChEMBL release reported by the status endpoint of the data web services, None if unavailable."""
+    import requests
+    s = Settings.Instance()
+    try:
+        res = requests.get(s.NEW_CLIENT_URL + '/status.json', timeout=s.TIMEOUT, proxies=s.PROXIES)
+        res.raise_for_status()
+        return res.json().get('chembl_db_version')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning('Could not check the current ChEMBL release: {0}'.format(e))
+        return None
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def check_release(backend=None):
+    """
+    With `Settings.RELEASE_AWARE_CACHING` responses from the data web services never expire. Instead, the cache is
+    tagged with the ChEMBL release it was filled from and cleared as a whole as soon as the web services report
+    a different one. The release is checked when the first session needs the cache and then at most every
+    `RELEASE_CHECK_INTERVAL` seconds. If it can't be determined the cache is kept as it is.
+    """
+    s = Settings.Instance()
+    if not s.CACHING or not s.RELEASE_AWARE_CACHING or s.OFFLINE:
+        return
+    from chembl_webresource_client.session import get_cache, get_cache_path
+    backend = backend or s.CACHE_BACKEND
+    key = (backend, get_cache_path(backend), s.NEW_CLIENT_URL)
+    if time.time() - _checked.get(key, 0) < s.RELEASE_CHECK_INTERVAL:
+        return
+    with _lock:
+        if time.time() - _checked.get(key, 0) < s.RELEASE_CHECK_INTERVAL:
+            return
+        _checked[key] = time.time()
+        release = fetch_release()
+        if release is None:
+            return
+        known = _releases.get(key) or (read_release_marker(backend) if backend != 'memory' else None)
+        if known != release:
+            from chembl_webresource_client.object_cache import object_cache, record_cache, negative_cache
+            logger.info('ChEMBL release changed from {0} to {1}, clearing the cache'.format(known, release))
+            cache = get_cache(backend)
+            cache.clear()
+            if hasattr(cache.responses, 'retain_release'):
+                cache.responses.retain_release(release)
+            object_cache.clear()
+            record_cache.clear()
+            negative_cache.clear()
+            if backend != 'memory':
+                write_release_marker(release, backend)
+        _releases[key] = release
+
+#-----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import logging
+import hashlib
+from chembl_webresource_client import __version__
+from chembl_webresource_client.settings import Settings
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+BUNDLED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemas')
+DATA_SPORE = 'data_spore.json'
+UTILS_SPORE = 'utils_spore.json'
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def get_schema_cache_dir():
+    return os.path.join(os.path.expanduser('~'), Settings.Instance().CACHE_NAME + '_schemas')
+
+
+def _cache_path(url):
+    return os.path.join(get_schema_cache_dir(), hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def _read_entry(url):
+    try:
+        with open(_cache_path(url)) as f:
+            entry = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if entry.get('url') != url or 'schema' not in entry:
+        return None
+    return entry
+
+
+def _write_entry(url, schema, etag):
+    entry = {'url': url, 'etag': etag, 'fetched_at': time.time(), 'client_version': __version__, 'schema': schema}
+    path = _cache_path(url)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except (IOError, OSError) as e:
+        logger.warning('Could not persist SPORE schema for {0}: {1}'.format(url, e))
+    return entry
+
+
+def load_bundled_schema(name):
+    with open(os.path.join(BUNDLED_DIR, name)) as f:
+        return json.load(f)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def load_schema(url, fallback=None):
+    """
+    Returns the SPORE schema published at `url`, going to the network as little as possible:
+
+    - a schema persisted on disk by this client version within `SCHEMA_CACHE_EXPIRE` is used as it is,
+    - an older one is revalidated with a conditional request (ETag), which costs a single round trip
+      with no payload if the schema hasn't changed,
+    - if the service can't be reached (or `Settings.OFFLINE` is set) the persisted schema is used regardless
+      of its age and, failing that, the `fallback` schema bundled with the package.
+    """
+    s = Settings.Instance()
+    entry = _read_entry(url) if s.SCHEMA_CACHING else None
+    fresh = entry and entry.get('client_version') == __version__ and \
+        time.time() - entry.get('fetched_at', 0) < s.SCHEMA_CACHE_EXPIRE
+    if fresh or (entry and s.OFFLINE):
+        return entry['schema']
+    error = 'offline mode'
+    if not s.OFFLINE:
+        import requests
+        headers = {'If-None-Match': entry['etag']} if entry and entry.get('etag') else {}
+        try:
+            res = requests.get(url, headers=headers, timeout=s.SCHEMA_TIMEOUT, proxies=s.PROXIES)
+            if res.status_code == 304 and entry:
+                schema, etag = entry['schema'], entry['etag']
+            elif res.ok:
+                schema, etag = res.json(), res.headers.get('ETag')
+            else:
+                schema, error = None, 'status {0} and msg {1}'.format(res.status_code, res.text)
+            if schema is not None:
+                if s.SCHEMA_CACHING:
+                    _write_entry(url, schema, etag)
+                return schema
+        except (requests.exceptions.RequestException, ValueError) as e:
+            error = str(e)
+    if entry:
+        logger.info('Using persisted SPORE schema for {0} ({1})'.format(url, error))
+        return entry['schema']
+    if fallback:
+        logger.info('Using bundled SPORE schema for {0} ({1})'.format(url, error))
+        return load_bundled_schema(fallback)
+    raise Exception('Error getting schema from url {0} with {1}'.format(url, error))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def refresh_bundled_schemas():
+    """Overwrites the bundled schemas with the ones currently published by the web services."""
+    import requests
+    s = Settings.Instance()
+    for url, name in ((s.NEW_CLIENT_URL + '/spore', DATA_SPORE), (s.UTILS_SPORE_URL, UTILS_SPORE)):
+        res = requests.get(url, timeout=s.SCHEMA_TIMEOUT, proxies=s.PROXIES)
+        res.raise_for_status()
+        with open(os.path.join(BUNDLED_DIR, name), 'w') as f:
+            json.dump(res.json(), f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    refresh_bundled_schemas()
+
+#-----------------------------------------------------------------------------------------------------------------------
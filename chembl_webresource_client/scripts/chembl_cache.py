@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+import re
+import sys
+import json
+import time
+import argparse
+from datetime import timezone
+from chembl_webresource_client.settings import Settings
+from chembl_webresource_client import cache_stats
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def parse_size(value):
+    """Parses sizes such as 500M or 2G (powers of 1024) into bytes."""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', value, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError('invalid size: {0}'.format(value))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '{0:.1f} {1}'.format(size, unit) if unit != 'B' else '{0} B'.format(size)
+        size /= 1024.0
+
+
+def parse_filter(value):
+    name, sep, filter_value = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError('invalid filter: {0}, expected NAME=VALUE'.format(value))
+    return name, filter_value
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_options(args=None):
+
+    description = 'Inspect and maintain the local cache of the ChEMBL web services client'
+    parser = argparse.ArgumentParser(description=description, prog='chembl_cache')
+    parser.add_argument('-b', '--backend', action='store', dest='backend', choices=('sqlite', 'filesystem'),
+                        help='cache backend, Settings.CACHE_BACKEND by default')
+    parser.add_argument('-n', '--name', action='store', dest='name',
+                        help='cache name (file name in the home directory or a path), Settings.CACHE_NAME by default')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    stats = commands.add_parser('stats', help='show entries, bytes and hit ratio of the HTTP cache per resource')
+    stats.add_argument('--json', action='store_true', dest='json', help='print the statistics as JSON')
+
+    prune = commands.add_parser('prune', help='delete some of the cached responses')
+    prune.add_argument('--older-than', action='store', dest='older_than', type=float, metavar='DAYS',
+                       help='delete responses cached more than DAYS days ago')
+    prune.add_argument('--resource', action='append', dest='resources', metavar='NAME',
+                       help='delete responses of this resource (e.g. molecule, activity, image, molecule/search), '
+                            'can be repeated')
+    prune.add_argument('--expired', action='store_true', dest='expired', help='delete expired responses')
+    prune.add_argument('--release', action='store', dest='release', metavar='RELEASE',
+                       help='delete everything unless the cache holds data from RELEASE (e.g. ChEMBL_33), '
+                            '"current" for the release the web services report')
+
+    commands.add_parser('compact', help='reclaim the disk space of deleted responses (VACUUM)')
+
+    cap = commands.add_parser('cap', help='delete the least used responses until the cache fits in SIZE')
+    cap.add_argument('size', type=parse_size, help='maximum size, e.g. 500M or 2G')
+    cap.add_argument('--eviction', action='store', dest='eviction', choices=('lru', 'lfu'), default='lru',
+                     help='keep the responses used most recently (lru, default) or most often (lfu)')
+
+    export = commands.add_parser('export', help='copy cached responses to another sqlite cache file')
+    export.add_argument('path', help='sqlite file to copy the responses to')
+    export.add_argument('--resource', action='append', dest='resources', metavar='NAME',
+                        help='only copy responses of this resource, can be repeated')
+
+    bundle = commands.add_parser('bundle', help='write cached responses to a bundle file for other machines')
+    bundle.add_argument('path', help='bundle file to write')
+    bundle.add_argument('--resource', action='append', dest='resources', metavar='NAME',
+                        help='only bundle responses of this resource, can be repeated')
+    bundle.add_argument('--filter', action='append', dest='filters', type=parse_filter, metavar='NAME=VALUE',
+                        help='only bundle responses of requests using this filter (e.g. target_chembl_id=CHEMBL240), '
+                             'can be repeated')
+    bundle.add_argument('--since', action='store', dest='since', type=float, metavar='MINUTES',
+                        help='only bundle responses used in the last MINUTES minutes, e.g. by a workflow')
+
+    import_bundle = commands.add_parser('import-bundle', help='copy the responses of a bundle file into the cache')
+    import_bundle.add_argument('path', help='bundle file to read')
+
+    return parser.parse_args(args)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def iter_entries(cache):
+    """Yields (key, size in bytes, response) for every response in the cache, None for unreadable responses."""
+    for key, size in cache.responses._stored_sizes():
+        try:
+            response = cache.responses.get(key)
+        except Exception:
+            response = None
+        yield key, size, response
+
+
+def delete_entries(cache, keys, backend):
+    keys = list(keys)
+    for i in range(0, len(keys), 500):
+        cache.delete(*keys[i:i + 500])
+    cache_stats.forget_entries(keys, backend)
+    return len(keys)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def show_stats(cache, backend, as_json=False, out=None):
+    # hits and misses of the HTTP cache, the in-process caches of other processes can't be seen from here
+    out = out or sys.stdout
+    resources, _ = cache_stats.read_stats(backend)
+    summary = {}
+    for key, size, response in iter_entries(cache):
+        resource = cache_stats.resource_label(response.url) if response is not None else 'unreadable'
+        entry = summary.setdefault(resource, {'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 0})
+        entry['entries'] += 1
+        entry['bytes'] += size
+    for resource, (hits, misses) in resources.items():
+        entry = summary.setdefault(resource, {'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 0})
+        entry['hits'], entry['misses'] = hits, misses
+    for entry in summary.values():
+        requests = entry['hits'] + entry['misses']
+        entry['hit_ratio'] = float(entry['hits']) / requests if requests else None
+    if as_json:
+        json.dump(summary, out, indent=2, sort_keys=True)
+        out.write('\n')
+        return summary
+    out.write('{0:<24} {1:>9} {2:>12} {3:>9} {4:>9} {5:>9}\n'.format('resource', 'entries', 'size', 'hits', 'misses',
+                                                                   'hit ratio'))
+    for resource in sorted(summary, key=lambda r: -summary[r]['bytes']):
+        entry = summary[resource]
+        ratio = '{0:.1%}'.format(entry['hit_ratio']) if entry['hit_ratio'] is not None else '-'
+        out.write('{0:<24} {1:>9} {2:>12} {3:>9} {4:>9} {5:>9}\n'.format(resource, entry['entries'],
+                                                                       format_size(entry['bytes']), entry['hits'],
+                                                                       entry['misses'], ratio))
+    out.write('{0:<24} {1:>9} {2:>12}\n'.format('total', sum(e['entries'] for e in summary.values()),
+                                                format_size(sum(e['bytes'] for e in summary.values()))))
+    return summary
+
+
+def prune(cache, backend, older_than=None, resources=None, expired=False, release=None):
+    from chembl_webresource_client.release import read_release_marker, write_release_marker, fetch_release
+    if release:
+        release = fetch_release() if release == 'current' else release
+        if release is None:
+            raise Exception('Could not determine the current ChEMBL release')
+        if read_release_marker(backend) != release:
+            count = len(cache.responses)
+            cache.clear()
+            cache_stats.clear_stats(backend)
+            write_release_marker(release, backend)
+            return count
+    if expired:
+        before = len(cache.responses)
+        cache.delete(expired=True)
+        count = before - len(cache.responses)
+    else:
+        count = 0
+    if older_than is None and not resources:
+        return count
+    limit = time.time() - older_than * 24 * 60 * 60 if older_than is not None else None
+    victims = []
+    for key, _, response in iter_entries(cache):
+        if response is None:
+            continue
+        created_at = response.created_at
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if limit is not None and created_at.timestamp() < limit:
+            victims.append(key)
+        elif resources and cache_stats.resource_label(response.url) in resources:
+            victims.append(key)
+    return count + delete_entries(cache, victims, backend)
+
+
+def compact(cache):
+    if hasattr(cache.responses, 'vacuum'):
+        cache.responses.vacuum()
+
+
+def cap(cache, backend, max_size, eviction='lru'):
+    """
+    Deletes responses until the cache fits in `max_size` bytes. Responses never used since they were cached go
+    first (oldest first), then the least recently (`lru`) or least frequently (`lfu`) used ones, as recorded by
+    the client sessions, so the entries in use are kept.
+    """
+    _, used = cache_stats.read_stats(backend)
+    entries = list(cache.responses._stored_sizes())
+    total = sum(size for _, size in entries)
+    if total <= max_size:
+        return 0
+
+    def rank(item):
+        position, (key, _) = item
+        hits, last_used = used.get(key, (0, None))
+        if last_used is None:
+            return (0, 0, position)
+        return (1, hits, last_used) if eviction == 'lfu' else (1, last_used, hits)
+
+    victims = []
+    for _, (key, size) in sorted(enumerate(entries), key=rank):
+        if total <= max_size:
+            break
+        victims.append(key)
+        total -= size
+    return delete_entries(cache, victims, backend)
+
+
+def export(cache, path, resources=None):
+    from chembl_webresource_client.cache_backends import create_cache
+    from chembl_webresource_client.compression import get_serializer
+    target = create_cache('sqlite', path, serializer=get_serializer())
+    count = 0
+    try:
+        with target.responses.bulk_commit():
+            for key, _, response in iter_entries(cache):
+                if response is None or (resources and cache_stats.resource_label(response.url) not in resources):
+                    continue
+                target.responses[key] = response
+                count += 1
+    finally:
+        target.close()
+    return count
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def main(args=None):
+
+    options = get_options(args)
+    settings = Settings.Instance()
+    if options.name:
+        settings.CACHE_NAME = options.name
+    # the script manages the cache as it is, it mustn't be cleared because of a new release
+    settings.RELEASE_AWARE_CACHING = False
+    from chembl_webresource_client.session import get_cache, close_sessions
+    backend = options.backend or settings.CACHE_BACKEND
+    cache = get_cache(backend)
+    try:
+        if options.command == 'stats':
+            show_stats(cache, backend, options.json)
+        elif options.command == 'prune':
+            count = prune(cache, backend, options.older_than, options.resources, options.expired, options.release)
+            print('Deleted {0} responses'.format(count))
+        elif options.command == 'compact':
+            compact(cache)
+        elif options.command == 'cap':
+            count = cap(cache, backend, options.size, options.eviction)
+            print('Deleted {0} responses'.format(count))
+        elif options.command == 'export':
+            count = export(cache, options.path, options.resources)
+            print('Exported {0} responses to {1}'.format(count, options.path))
+        elif options.command == 'bundle':
+            from chembl_webresource_client.bundles import export_bundle
+            since = time.time() - options.since * 60 if options.since is not None else None
+            count = export_bundle(cache, options.path, resources=options.resources, filters=options.filters,
+                                  since=since, backend=backend)
+            print('Bundled {0} responses in {1}'.format(count, options.path))
+        elif options.command == 'import-bundle':
+            from chembl_webresource_client.bundles import import_bundle
+            count = import_bundle(options.path, cache, backend)
+            print('Imported {0} responses from {1}'.format(count, options.path))
+    finally:
+        close_sessions()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    main()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+import argparse
+from chembl_webresource_client.settings import Settings
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def get_options(args=None):
+
+    description = 'Run a caching proxy for the ChEMBL data web services, so many clients share one cache. Clients ' \
+                  'use it by setting Settings.Instance().NEW_CLIENT_URL to the url it prints'
+    parser = argparse.ArgumentParser(description=description, prog='chembl_proxy')
+    parser.add_argument('-H', '--host', action='store', dest='host', default='127.0.0.1',
+                        help='address to listen on, 127.0.0.1 by default, 0.0.0.0 for all interfaces')
+    parser.add_argument('-p', '--port', action='store', dest='port', type=int, default=8765,
+                        help='port to listen on, 8765 by default')
+    parser.add_argument('-u', '--upstream', action='store', dest='upstream',
+                        help='url of the data web services, Settings.NEW_CLIENT_URL by default')
+    parser.add_argument('-b', '--backend', action='store', dest='backend', choices=('sqlite', 'filesystem', 'memory'),
+                        help='cache backend, Settings.CACHE_BACKEND by default')
+    parser.add_argument('-n', '--name', action='store', dest='name',
+                        help='cache name (file name in the home directory or a path), Settings.CACHE_NAME by default')
+    return parser.parse_args(args)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def main(args=None):
+
+    options = get_options(args)
+    settings = Settings.Instance()
+    settings.CACHING = True
+    if options.upstream:
+        # cache policies and release checks refer to the proxied web services
+        settings.NEW_CLIENT_URL = options.upstream.rstrip('/')
+    if options.name:
+        settings.CACHE_NAME = options.name
+    from chembl_webresource_client.proxy import CachingProxy
+    from chembl_webresource_client.session import close_sessions
+    proxy = CachingProxy(host=options.host, port=options.port, backend=options.backend)
+    print('Proxying {0} at {1}'.format(proxy.upstream, proxy.url))
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.server_close()
+        close_sessions()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    main()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,185 @@
+import os
+import atexit
+import threading
+from urllib.parse import urlparse
+from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.release import check_release
+from chembl_webresource_client import cache_stats
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+_sessions = {}
+_caches = {}
+_lock = threading.RLock()
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+# settings the sessions are configured from, a session is created again when any of them changes
+SESSION_SETTINGS = ('CACHING', 'CACHE_NAME', 'CACHE_EXPIRE', 'FAST_SAVE', 'CACHE_MAX_SIZE', 'CACHE_EVICTION',
+                    'CACHE_COMPRESSION', 'CACHE_COMPRESSION_THRESHOLD', 'CACHE_COMPRESSION_LEVEL', 'CACHE_WAL',
+                    'CACHE_BUSY_TIMEOUT', 'CACHE_REFRESH_INTERVAL', 'CACHE_STATS', 'CACHE_BUNDLES',
+                    'CACHE_WRITE_BEHIND', 'CACHE_WRITE_BATCH_SIZE', 'CACHE_WRITE_INTERVAL', 'CACHE_WRITE_MAX_PENDING',
+                    'RELEASE_AWARE_CACHING', 'NEW_CLIENT_URL', 'CACHE_POLICIES', 'TOTAL_RETRIES', 'BACKOFF_FACTOR',
+                    'CONCURRENT_SIZE', 'PROXIES')
+
+
+def _settings_key():
+    s = Settings.Instance()
+    # repr, as some of the settings are dicts or lists
+    return tuple(repr(getattr(s, name)) for name in SESSION_SETTINGS)
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def get_cache_path(backend=None):
+    path = os.path.join(os.path.expanduser('~'), Settings.Instance().CACHE_NAME)
+    if (backend or Settings.Instance().CACHE_BACKEND) == 'filesystem':
+        path += '_files'
+    return path
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def get_cache(backend=None):
+    """
+    Returns the cache shared by all sessions using the given backend (`Settings.CACHE_BACKEND` by default) and
+    the current cache settings.
+    """
+    from chembl_webresource_client.cache_backends import create_cache
+    from chembl_webresource_client.compression import get_serializer
+    s = Settings.Instance()
+    backend = backend or s.CACHE_BACKEND
+    key = (backend, get_cache_path(backend), s.FAST_SAVE, s.CACHE_MAX_SIZE, s.CACHE_EVICTION, s.CACHE_COMPRESSION,
+           s.CACHE_COMPRESSION_THRESHOLD, s.CACHE_COMPRESSION_LEVEL, s.CACHE_WAL, s.CACHE_BUSY_TIMEOUT,
+           s.CACHE_REFRESH_INTERVAL, s.CACHE_WRITE_BEHIND, s.CACHE_WRITE_BATCH_SIZE, s.CACHE_WRITE_INTERVAL,
+           s.CACHE_WRITE_MAX_PENDING, tuple(s.CACHE_BUNDLES or ()))
+    write_behind = None
+    if s.CACHE_WRITE_BEHIND:
+        write_behind = {'batch_size': s.CACHE_WRITE_BATCH_SIZE, 'interval': s.CACHE_WRITE_INTERVAL,
+                        'max_pending': s.CACHE_WRITE_MAX_PENDING}
+    with _lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = create_cache(backend, get_cache_path(backend), max_size=s.CACHE_MAX_SIZE,
+                                                eviction=s.CACHE_EVICTION, fast_save=s.FAST_SAVE,
+                                                serializer=get_serializer(), wal=s.CACHE_WAL,
+                                                busy_timeout=s.CACHE_BUSY_TIMEOUT,
+                                                refresh_interval=s.CACHE_REFRESH_INTERVAL,
+                                                write_behind=write_behind)
+            if s.CACHE_BUNDLES and backend != 'memory':
+                from chembl_webresource_client.bundles import mount_bundles
+                mount_bundles(cache, s.CACHE_BUNDLES, backend)
+        return cache
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def _create_session(headers, backend=None, caching=None, retry=None):
+    # requests and requests_cache account for most of the import time of the package, so they are only
+    # loaded once a session is actually needed
+    import requests
+    import requests_cache
+    from urllib3.util import Retry
+    from chembl_webresource_client.cache_policies import urls_expire_after, filter_response
+    s = Settings.Instance()
+    caching = s.CACHING if caching is None else caching
+    retry = retry or Retry(total=s.TOTAL_RETRIES, backoff_factor=s.BACKOFF_FACTOR,
+                           status_forcelist=(list(range(400, 421)) + list(range(500, 505))))
+    size = s.CONCURRENT_SIZE
+    adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size,
+                                            pool_block=True, max_retries=retry)
+    expire_patterns = urls_expire_after()
+    if s.RELEASE_AWARE_CACHING:
+        expire_patterns[s.NEW_CLIENT_URL] = requests_cache.NEVER_EXPIRE
+    session = requests_cache.CachedSession(
+        backend=get_cache(backend),
+        expire_after=s.CACHE_EXPIRE,
+        urls_expire_after=expire_patterns,
+        filter_fn=filter_response,
+        allowable_methods=('GET', 'POST'),
+        match_headers=True) if caching else requests.Session()
+    if caching and s.CACHE_STATS and (backend or s.CACHE_BACKEND) != 'memory':
+        session.hooks['response'].append(cache_stats.stats_hook(backend))
+    if s.PROXIES:
+        session.proxies = s.PROXIES
+    session.headers.update(headers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def get_session(url=None, headers=None, backend=None, retry=None):
+    """
+    Returns the session for the host of `url`, creating it on first use. Sessions are shared by every client
+    in the process talking to the same host with the same settings and default headers, so they all reuse
+    keep-alive connections from one pool and a single cache handle. Changing the relevant `Settings` simply
+    results in a new session from then on, and the connections of the one it replaces are closed. `backend`
+    selects a cache backend other than `Settings.CACHE_BACKEND` and `retry` replaces the retry policy of the data
+    web services. Sessions for the data web services also make sure the cache holds data from the current
+    ChEMBL release.
+    """
+    headers = headers or {}
+    key = (urlparse(url).netloc if url else None, tuple(sorted(headers.items())),
+           backend or Settings.Instance().CACHE_BACKEND, retry) + _settings_key()
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                _close_outdated(key)
+                session = _sessions[key] = _create_session(headers, backend, retry=retry)
+    if url and _is_data_url(url):
+        check_release(backend)
+    return session
+
+
+def _close_outdated(key):
+    # a session for the same host, headers, backend and retries but older settings won't be asked for again;
+    # only its connections are closed, as the cache handle is shared with the other sessions
+    import requests
+    for outdated in [k for k in _sessions if k[:4] == key[:4]]:
+        requests.Session.close(_sessions.pop(outdated))
+
+
+def _is_data_url(url):
+    # UniChem and the utils web services share the host of the data web services, but not its release
+    parsed, data = urlparse(url), urlparse(Settings.Instance().NEW_CLIENT_URL)
+    path = data.path.rstrip('/')
+    return parsed.netloc == data.netloc and (parsed.path == path or parsed.path.startswith(path + '/'))
+
+#-----------------------------------------------------------------------------------------------------------------------
+
+
+def close_sessions():
+    """Closes all the shared sessions, their connection pools and cache handles."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        for cache in _caches.values():
+            cache.close()
+        _sessions.clear()
+        _caches.clear()
+    cache_stats.flush()
+
+
+atexit.register(close_sessions)
+
+
+def _forget_sessions():
+    # sqlite connections and connection pools can't be shared with a forked child (e.g. a multiprocessing
+    # worker), it opens its own on first use instead
+    global _lock
+    _lock = threading.RLock()
+    _sessions.clear()
+    _caches.clear()
+    # the parent saves the statistics it gathered before forking
+    cache_stats._pending.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_sessions)
+
+#-----------------------------------------------------------------------------------------------------------------------
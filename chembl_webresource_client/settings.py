@@ -16,8 +16,46 @@ class Settings:
     TOTAL_RETRIES = 3
     BACKOFF_FACTOR = 2
     CONCURRENT_SIZE = 50
+    SCAN_WORKERS = 4
+    READ_AHEAD = 0
     CACHE_EXPIRE = 60 * 60 * 24
+    RELEASE_AWARE_CACHING = True
+    RELEASE_CHECK_INTERVAL = 60 * 60
     CACHE_NAME = default_cache_name
+    CACHE_BACKEND = 'sqlite'
+    CACHE_MAX_SIZE = 1024 * 1024 * 1024
+    CACHE_EVICTION = 'lru'
+    CACHE_COMPRESSION = 'zlib'
+    CACHE_COMPRESSION_THRESHOLD = 1024
+    CACHE_COMPRESSION_LEVEL = None
+    CACHE_WAL = True
+    CACHE_BUSY_TIMEOUT = 30 * 1000
+    CACHE_REFRESH_INTERVAL = 60
+    CACHE_STATS = True
+    CACHE_BUNDLES = None
+    CACHE_WRITE_BEHIND = False
+    CACHE_WRITE_BATCH_SIZE = 100
+    CACHE_WRITE_INTERVAL = 1.0
+    CACHE_WRITE_MAX_PENDING = 64 * 1024 * 1024
+    CACHE_POLICIES = {
+        'atc_class': {'expire': -1},
+        'go_slim': {'expire': -1},
+        'organism': {'expire': -1},
+        'protein_class': {'expire': -1},
+        'source': {'expire': -1},
+        'similarity': {'max_entry_size': 1024 * 1024},
+        'substructure': {'max_entry_size': 1024 * 1024},
+        'search': {'max_entry_size': 1024 * 1024},
+        'image': {'backend': 'filesystem', 'object_cache': False},
+    }
+    OBJECT_CACHE_MAX_SIZE = 64 * 1024 * 1024
+    RECORD_CACHE_MAX_SIZE = 64 * 1024 * 1024
+    NEGATIVE_CACHE_EXPIRE = 60 * 60
+    NEGATIVE_CACHE_MAX_SIZE = 4 * 1024 * 1024
+    SCHEMA_CACHING = True
+    SCHEMA_CACHE_EXPIRE = 60 * 60 * 24 * 7
+    SCHEMA_TIMEOUT = 3.0
+    OFFLINE = False
     RESPECT_RATE_LIMIT = True
     TIMEOUT = 3.0
     UTILS_SPORE_URL = 'https://www.ebi.ac.uk/chembl/api/utils/spore'
@@ -27,14 +65,29 @@ class Settings:
     NEW_CLIENT_TIMEOUT = None
     TEST_CASE_TIMEOUT = 10
     MAX_LIMIT = 20
+    MIN_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 1000
+    ADAPTIVE_TARGET_TIME = 1.0
+    ADAPTIVE_MAX_BYTES = 4 * 1024 * 1024
     REPR_OUTPUT_SIZE = 5
     MAX_URL_SIZE = 4000
+    MAX_IN_VALUES = 1000
+    MAX_BODY_SIZE = 64 * 1024
+    GET_BATCHING = False
+    GET_BATCH_WINDOW = 0.005
+    GET_BATCH_MAX_SIZE = 100
     PROXIES = None
     CLIENT_VERSION_PICKLE_KEY = 'chembl_webresource_client_version'
 
     def clear_cache(self):
-        from requests_cache import clear
-        clear()
+        from chembl_webresource_client.session import get_cache
+        from chembl_webresource_client.object_cache import object_cache, record_cache, negative_cache
+        get_cache().clear()
+        for backend in sorted({p['backend'] for p in (self.CACHE_POLICIES or {}).values() if p.get('backend')}):
+            get_cache(backend).clear()
+        object_cache.clear()
+        record_cache.clear()
+        negative_cache.clear()
 
     def __str__(self):
         return 'ChEMBL API client settings:\n' + \
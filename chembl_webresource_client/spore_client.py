@@ -2,22 +2,25 @@ from urllib.parse import urljoin
 import json
 
 from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.schema_cache import load_schema
 import time
 import re
-import requests
 from easydict import EasyDict
 
 OFFICIAL_ENDPOINT = re.compile('^http(s)?://www(dev)?.ebi.ac.uk/chembl/api/utils/spore')
 
-def client_from_url(url, session=requests, base_url=None):
+def client_from_url(url, session=None, base_url=None, fallback=None):
     """Builds a client from an url
 
     :param url: the url you want to get the SPORE schema from
-    :param session: the :class:`request.Session` instance to use. Defaults to
-                    the requests module itself.
+    :param session: the :class:`request.Session` instance to use, or a
+                    function returning it. Defaults to the requests module
+                    itself.
+    :param fallback: name of the bundled schema to use if it can't be
+                     fetched and wasn't persisted before.
 
     """
-    schema = requests.get(url).json()
+    schema = load_schema(url, fallback=fallback)
     if 'base_url' not in schema:
         if base_url:
             schema['base_url'] = base_url
@@ -96,7 +99,7 @@ class Client(object):
 
     :param session:
         a :class:`requests.Session` instance that will be used to perform the
-        http requests.
+        http requests, or a function returning it when the first request is made.
 
     This client provides two main things: the description, available as
     a dotted dict, and a number of methods to interact with the service.
@@ -105,6 +108,7 @@ class Client(object):
     def __init__(self, description, session=None, official = False):
         self.description = EasyDict(description)
         if session is None:
+            import requests
             session = requests
         self.session = session
         self.official = official
@@ -144,14 +148,15 @@ class Client(object):
         if path.startswith('/'):
             path = path[1:]
         url = urljoin(self.description.base_url, path)
+        session = self.session() if callable(self.session) else self.session
         if len(method_args) == 1:
             method_kw['data'] = method_args[0]
         elif 'data' not in method_kw:
-            resp = self.session.request(definition.method, url, data=json.dumps(method_kw))
+            resp = session.request(definition.method, url, data=json.dumps(method_kw))
             return decode_response(resp, definition)
 
         # make the actual query to the resource
-        resp = self.session.request(definition.method, url, **method_kw)
+        resp = session.request(definition.method, url, **method_kw)
         if (not hasattr(resp, 'from_cache') or not resp.from_cache) and (self.official or
                                                                          Settings.Instance().RESPECT_RATE_LIMIT):
             hourly_rate = int(resp.headers.get('x-hourlyratelimit-limit', 3600))
@@ -0,0 +1,709 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+import unittest
+from contextlib import contextmanager
+from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.query_set import QuerySet
+from chembl_webresource_client.query_set import Model
+from chembl_webresource_client.local_server import LocalServer
+
+
+@contextmanager
+def override_settings(**kw):
+    """Changes `Settings` for the duration of the block; every setting, even those changed inside it, is restored."""
+    settings = Settings.Instance()
+    saved = dict((name, getattr(settings, name)) for name in dir(settings) if name.isupper())
+    for name, value in kw.items():
+        setattr(settings, name, value)
+    try:
+        yield settings
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+
+class TestLocalServer(unittest.TestCase):
+    """Tests running against a local stand-in for the web services, so they don't need network access."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+        cls.overrides = override_settings(NEW_CLIENT_URL=cls.server.url, CACHING=False, RELEASE_AWARE_CACHING=False,
+                                          CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'chembl_ws_client'))
+        cls.overrides.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.overrides.__exit__(None, None, None)
+        cls.server.stop()
+
+    def setUp(self):
+        self.activity = QuerySet(model=Model('activity', 'activities', ('json', 'xml')))
+        self.molecule = QuerySet(model=Model('molecule', 'molecules', ('json', 'xml')))
+        del self.server.requests[:]
+
+    def tearDown(self):
+        from chembl_webresource_client.session import close_sessions
+        from chembl_webresource_client.object_cache import object_cache, record_cache, negative_cache
+        close_sessions()
+        for cache in (object_cache, record_cache, negative_cache):
+            cache.clear()
+        self.server.latency, self.server.release = 0.0, 'ChEMBL_99'
+
+    def server_params(self, i):
+        return json.loads(self.server.requests[i][2].decode('utf-8'))
+
+    def test_sequential_iteration(self):
+        ids = [act['activity_id'] for act in self.activity.filter(standard_type='Ki').order_by('activity_id')]
+        self.assertEqual(ids, list(range(1, 1001))[::3])
+
+    def test_parallel_iterator(self):
+        qs = self.activity.filter(standard_type='Ki').order_by('activity_id')
+        ids = [act['activity_id'] for act in qs.iterator(workers=4, window=3)]
+        self.assertEqual(ids, list(range(1, 1001))[::3])
+        self.assertEqual(len(self.server.requests), 17)
+
+    def test_parallel_iterator_slice(self):
+        qs = self.activity.order_by('activity_id')[45:107]
+        self.assertEqual([act['activity_id'] for act in qs.iterator(workers=3)], list(range(46, 108)))
+
+    def test_parallel_iterator_early_exit(self):
+        it = self.activity.order_by('activity_id').iterator(workers=2, window=2)
+        self.assertEqual([next(it)['activity_id'] for _ in range(25)], list(range(1, 26)))
+        it.close()
+        self.assertLessEqual(len(self.server.requests), 4)
+
+    def test_read_ahead(self):
+        qs = self.activity.filter(standard_type='Ki').order_by('activity_id').read_ahead(2)
+        ids = [act['activity_id'] for act in qs]
+        self.assertEqual(ids, list(range(1, 1001))[::3])
+        self.assertEqual(len(self.server.requests), 17)
+
+    def test_page_size(self):
+        qs = self.activity.filter(standard_type='Ki').page_size(100)
+        self.assertEqual(len(list(qs)), 334)
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(qs.page_size(10 ** 6).query.limit, Settings.Instance().MAX_PAGE_SIZE)
+
+    def test_adaptive_page_size(self):
+        qs = self.activity.order_by('activity_id').page_size('auto')
+        self.assertEqual([act['activity_id'] for act in qs], list(range(1, 1001)))
+        self.assertLess(len(self.server.requests), 1000 // Settings.Instance().MAX_LIMIT)
+        self.assertEqual([act['activity_id'] for act in qs[10:30]], list(range(11, 31)))
+
+    def test_keyset_pagination(self):
+        qs = self.activity.filter(standard_type='Ki').keyset('activity_id')
+        self.assertEqual([act['activity_id'] for act in qs], list(range(1, 1001))[::3])
+        self.assertTrue(all(('offset', 0) in [tuple(p) for p in self.server_params(i)] for i in range(1, 17)))
+        self.assertTrue(all(['activity_id__gt', 1 + 60 * i - 3] in self.server_params(i) for i in range(1, 17)))
+        resumed = self.activity.filter(standard_type='Ki').keyset('activity_id', after=901)
+        self.assertEqual([act['activity_id'] for act in resumed], list(range(904, 1001, 3)))
+        self.assertEqual(len(resumed), 33)
+
+    def test_keyset_ordering(self):
+        descending = self.activity.keyset('activity_id').order_by('-activity_id')
+        self.assertEqual([act['activity_id'] for act in descending], list(range(1000, 0, -1)))
+        self.assertIn(['activity_id__lt', 981], self.server_params(1))
+        reversed_qs = self.activity.filter(standard_type='Ki').keyset('activity_id', after=901)
+        reversed_qs.reverse()
+        self.assertEqual([act['activity_id'] for act in reversed_qs], list(range(898, 0, -3)))
+        with self.assertRaises(Exception):
+            self.activity.keyset('activity_id').order_by('standard_value')
+
+    def test_async_client(self):
+        import requests
+        from chembl_webresource_client.async_client import async_client_from_schema
+        client = async_client_from_schema(requests.get(self.server.url + '/spore').json())
+
+        async def scenario():
+            qs = client.activity.filter(standard_type='Ki').order_by('activity_id')
+            ids = [act['activity_id'] async for act in qs]
+            pages = [len(page) async for page in client.activity.order_by('activity_id')[5:50].pages()]
+            mols, count, first = await asyncio.gather(client.molecule.get(['CHEMBL3', 'CHEMBL1']),
+                                                      client.activity.filter(standard_type='Ki').count(),
+                                                      client.molecule.filter(pref_name='MOLECULE 7').first())
+            single = await client.molecule.get('CHEMBL5')
+            named = await client.molecule.get(pref_name=['MOLECULE 2', 'MOLECULE 4']).list()
+            del self.server.requests[:]
+            keyset = [[act['activity_id'] for act in page]
+                      async for page in client.activity.filter(standard_type='Ki').keyset('activity_id', after=901)
+                      .pages()]
+            return ids, pages, mols, count, first, single, named, keyset
+
+        ids, pages, mols, count, first, single, named, keyset = asyncio.run(scenario())
+        self.assertEqual(ids, list(range(1, 1001))[::3])
+        self.assertEqual(pages, [20, 20, 5])
+        self.assertEqual([m['molecule_chembl_id'] for m in named], ['CHEMBL2', 'CHEMBL4'])
+        self.assertEqual(keyset, [list(range(904, 962, 3)), list(range(964, 1001, 3))])
+        self.assertIn(['activity_id__gt', 961], self.server_params(1))
+        self.assertEqual([m['molecule_chembl_id'] for m in mols], ['CHEMBL3', 'CHEMBL1'])
+        self.assertEqual(count, 334)
+        self.assertEqual(first['molecule_chembl_id'], 'CHEMBL7')
+        self.assertEqual(single['molecule_chembl_id'], 'CHEMBL5')
+
+    def test_shared_session(self):
+        from chembl_webresource_client.session import close_sessions
+        qs = self.activity.filter(standard_type='Ki').only('activity_id')
+        session = qs.query.session
+        self.assertIs(session, self.molecule[:5].query.session)
+        close_sessions()
+        self.assertIsNot(session, qs.query.session)
+        self.assertEqual(len(qs), 334)
+
+    def test_outdated_sessions(self):
+        from chembl_webresource_client import session as sessions
+        from chembl_webresource_client.utils import get_session
+        data = sessions.get_session(self.server.url)
+        self.assertEqual(data.get_adapter(self.server.url).max_retries.status_forcelist[0], 400)
+        with override_settings(UTILS_SPORE_URL=self.server.url + '/utils/spore'):
+            retries = get_session().get_adapter(self.server.url).max_retries
+        self.assertEqual((retries.total, bool(retries.status_forcelist), retries.backoff_factor), (3, False, 0))
+        self.assertEqual(len(data.get(self.server.url + '/status.json').json()), 2)
+        self.assertEqual(len(data.get_adapter(self.server.url).poolmanager.pools), 1)
+        with override_settings(TOTAL_RETRIES=5):
+            self.assertIsNot(sessions.get_session(self.server.url), data)
+        self.assertEqual(len(data.get_adapter(self.server.url).poolmanager.pools), 0)
+        self.assertEqual(len(sessions._sessions), 2)
+
+    def test_schema_cache(self):
+        from chembl_webresource_client.schema_cache import load_schema, DATA_SPORE
+        from chembl_webresource_client.new_client import client_from_url
+        url = self.server.url + '/spore?schema_cache'
+        self.assertIn('GET_molecule_dispatch_detail', load_schema(url)['methods'])
+        self.assertEqual(len(self.server.requests), 1)
+        client = client_from_url(url)
+        self.assertEqual(client.molecule.get('CHEMBL3')['molecule_chembl_id'], 'CHEMBL3')
+        self.assertEqual(len(self.server.requests), 2)
+        with override_settings(SCHEMA_CACHE_EXPIRE=0) as settings:
+            self.assertIn('GET_activity_dispatch_detail', load_schema(url)['methods'])
+            self.assertEqual(self.server.requests[-1][0], 'GET')
+            settings.OFFLINE = True
+            self.assertIn('GET_activity_dispatch_detail', load_schema(url)['methods'])
+            self.assertIn('GET_target_dispatch_detail', load_schema(url + '?v=2', fallback=DATA_SPORE)['methods'])
+            self.assertEqual(len(self.server.requests), 3)
+
+    def test_lazy_resources(self):
+        from chembl_webresource_client.schema_cache import load_bundled_schema, DATA_SPORE
+        from chembl_webresource_client.new_client import client_from_schema
+        from chembl_webresource_client.query_set import QuerySet
+        client = client_from_schema(load_bundled_schema(DATA_SPORE))
+        self.assertIn('molecule', dir(client))
+        self.assertFalse([v for v in vars(client).values() if isinstance(v, QuerySet)])
+        self.assertIs(client.molecule, client.molecule)
+        self.assertEqual([k for k, v in vars(client).items() if isinstance(v, QuerySet)], ['molecule'])
+        self.assertRaises(AttributeError, getattr, client, 'no_such_resource')
+
+    def test_cache_backends(self):
+        from chembl_webresource_client.cache_backends import BACKENDS
+        from chembl_webresource_client.session import get_cache
+        with override_settings(CACHING=True, CACHE_MAX_SIZE=6000, OBJECT_CACHE_MAX_SIZE=0, RECORD_CACHE_MAX_SIZE=0):
+            for backend in BACKENDS:
+                molecule = self.molecule.using(backend)
+                for i in range(2, 12):
+                    molecule.get('CHEMBL1')
+                    molecule.get('CHEMBL{0}'.format(i))
+                del self.server.requests[:]
+                molecule.get('CHEMBL1')
+                molecule.get('CHEMBL11')
+                self.assertEqual(self.server.requests, [])
+                molecule.get('CHEMBL2')
+                self.assertEqual(len(self.server.requests), 1)
+                self.assertLessEqual(get_cache(backend).responses.total_size, 6000)
+
+    def test_shared_cache(self):
+        import sys
+        import sqlite3
+        import subprocess
+        from chembl_webresource_client.session import get_cache, get_cache_path
+        code = ("import sys; from chembl_webresource_client.settings import Settings; s = Settings.Instance(); "
+                "s.NEW_CLIENT_URL, s.CACHE_NAME, s.RELEASE_AWARE_CACHING = sys.argv[1], sys.argv[2], False; "
+                "from chembl_webresource_client.session import get_session; session = get_session(s.NEW_CLIENT_URL); "
+                "[session.get(s.NEW_CLIENT_URL + '/molecule/CHEMBL{0}.json'.format(i)).raise_for_status() "
+                "for i in range(1, 21)]")
+        with override_settings(CACHING=True, CACHE_REFRESH_INTERVAL=0,
+                               CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'shared')) as settings:
+            self.assertEqual(get_cache().responses.total_size, 0)
+            workers = [subprocess.Popen([sys.executable, '-c', code, self.server.url, settings.CACHE_NAME])
+                       for _ in range(4)]
+            self.assertEqual([worker.wait() for worker in workers], [0] * 4)
+            self.assertEqual(len(get_cache().responses), 20)
+            self.assertGreater(get_cache().responses.total_size, 0)
+            with sqlite3.connect(get_cache_path() + '.sqlite') as con:
+                self.assertEqual(con.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_write_behind(self):
+        from chembl_webresource_client.session import get_cache, close_sessions
+        with override_settings(CACHING=True, CACHE_WRITE_BEHIND=True, CACHE_WRITE_INTERVAL=60,
+                               CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'write_behind'),
+                               OBJECT_CACHE_MAX_SIZE=0, RECORD_CACHE_MAX_SIZE=0) as settings:
+            for i in range(1, 4):
+                self.molecule.get('CHEMBL{0}'.format(i))
+            self.assertEqual(len(get_cache().responses.storage), 0)
+            self.molecule.get('CHEMBL1')
+            self.assertEqual(len(self.server.requests), 3)
+            close_sessions()
+            self.assertEqual(len(get_cache().responses), 3)
+            self.molecule.get('CHEMBL2')
+            self.assertEqual(len(self.server.requests), 3)
+            settings.CACHE_WRITE_MAX_PENDING = 0
+            self.molecule.get('CHEMBL4')
+            self.assertEqual(len(get_cache().responses.storage), 4)
+
+    def test_cache_script(self):
+        import io
+        from contextlib import redirect_stdout
+        from chembl_webresource_client.scripts.chembl_cache import main
+        from chembl_webresource_client.session import get_cache, close_sessions
+        with override_settings(CACHING=True, CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'script'),
+                               OBJECT_CACHE_MAX_SIZE=0, RECORD_CACHE_MAX_SIZE=0) as settings:
+            for i in range(1, 11):
+                self.molecule.get('CHEMBL{0}'.format(i))
+            list(self.activity[:5])
+            self.molecule.get('CHEMBL1')
+            size = get_cache().responses.total_size
+            close_sessions()
+            out = io.StringIO()
+            with redirect_stdout(out):
+                main(['stats', '--json'])
+            stats = json.loads(out.getvalue())
+            self.assertEqual((stats['molecule']['entries'], stats['molecule']['hits']), (10, 1))
+            self.assertEqual((stats['activity']['entries'], stats['activity']['misses']), (1, 1))
+            export = os.path.join(tempfile.mkdtemp(), 'export')
+            with redirect_stdout(io.StringIO()):
+                main(['export', export, '--resource', 'activity'])
+                main(['cap', str(size // 2)])
+                main(['prune', '--resource', 'activity'])
+                main(['compact'])
+            self.assertLessEqual(get_cache().responses.total_size, size // 2)
+            del self.server.requests[:]
+            self.molecule.get('CHEMBL1')
+            self.assertEqual(self.server.requests, [])
+            list(self.activity[:5])
+            self.assertEqual(len(self.server.requests), 1)
+            settings.CACHE_NAME = export
+            del self.server.requests[:]
+            list(self.activity[:5])
+            self.assertEqual(self.server.requests, [])
+
+    def test_cache_bundles(self):
+        import io
+        import sqlite3
+        from contextlib import closing, redirect_stdout
+        from chembl_webresource_client.scripts.chembl_cache import main
+        from chembl_webresource_client.session import get_cache, close_sessions
+        with override_settings(CACHING=True, CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'workflow'),
+                               OBJECT_CACHE_MAX_SIZE=0, RECORD_CACHE_MAX_SIZE=0) as settings:
+            for i in range(1, 6):
+                self.molecule.get('CHEMBL{0}'.format(i))
+            self.molecule.get('CHEMBL1')
+            list(self.activity[:5])
+            close_sessions()
+            bundle = os.path.join(tempfile.mkdtemp(), 'molecules.bundle')
+            with redirect_stdout(io.StringIO()):
+                main(['bundle', bundle, '--resource', 'molecule', '--since', '10'])
+            with closing(sqlite3.connect(bundle)) as con:
+                self.assertEqual(con.execute('SELECT COUNT(*) FROM entries').fetchone()[0], 5)
+                self.assertEqual(con.execute('SELECT COUNT(*) FROM blobs').fetchone()[0], 5)
+
+            settings.CACHE_NAME = os.path.join(tempfile.mkdtemp(), 'node')
+            settings.CACHE_BUNDLES = [bundle]
+            del self.server.requests[:]
+            self.assertEqual(self.molecule.get('CHEMBL3')['pref_name'], 'MOLECULE 3')
+            self.assertEqual(self.server.requests, [])
+            list(self.activity[:5])
+            self.assertEqual(len(self.server.requests), 1)
+            self.assertEqual(len(get_cache().responses), 1)
+
+            settings.CACHE_NAME, settings.CACHE_BUNDLES = os.path.join(tempfile.mkdtemp(), 'imported'), None
+            with redirect_stdout(io.StringIO()):
+                main(['import-bundle', bundle])
+            del self.server.requests[:]
+            self.molecule.get('CHEMBL5')
+            self.assertEqual(self.server.requests, [])
+
+    def test_caching_proxy(self):
+        import requests
+        from concurrent.futures import ThreadPoolExecutor
+        from chembl_webresource_client.proxy import CachingProxy
+        with override_settings(CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'proxy'), OBJECT_CACHE_MAX_SIZE=0,
+                               RECORD_CACHE_MAX_SIZE=0) as settings:
+            self.server.latency = 0.2
+            proxy = CachingProxy().start()
+            try:
+                settings.NEW_CLIENT_URL = proxy.url
+                qs = QuerySet(model=Model('activity', 'activities', ('json', 'xml'))).filter(standard_type='Ki')
+                settings.NEW_CLIENT_URL = self.server.url
+                with ThreadPoolExecutor(8) as pool:
+                    results = list(pool.map(lambda _: [act['activity_id'] for act in qs.order_by('activity_id')[:20]],
+                                            range(8)))
+                self.assertEqual(results, [list(range(1, 1001))[:60:3]] * 8)
+                self.assertEqual(len(self.server.requests), 1)
+                self.assertGreater(proxy.stats()['coalesced'], 0)
+                res = requests.get(proxy.url + '/molecule/CHEMBL3.json')
+                self.assertEqual((res.json()['pref_name'], res.headers['X-Cache']), ('MOLECULE 3', 'MISS'))
+                self.assertEqual(requests.get(proxy.url + '/molecule/CHEMBL3.json').headers['X-Cache'], 'HIT')
+                self.assertEqual(requests.get(proxy.url + '/molecule/CHEMBL404.json').status_code, 404)
+                self.assertEqual(requests.get(proxy.url + '/status.json').headers['X-Cache'], 'MISS')
+                self.assertEqual(requests.get(proxy.url + '/status.json').headers['X-Cache'], 'MISS')
+                self.assertEqual(len(self.server.requests), 5)
+            finally:
+                proxy.stop()
+
+    def test_chunked_in_filter(self):
+        with override_settings(MAX_IN_VALUES=100) as settings:
+            ids = list(range(1000, 0, -2)) + [2, 4]
+            qs = self.activity.filter(activity_id__in=ids, standard_type__in=['Ki', 'IC50']).order_by('-activity_id')
+            expected = [i for i in range(1000, 0, -2) if i % 3 != 2]
+            self.assertEqual(len(qs), len(expected))
+            self.assertEqual(len(self.server.requests), 5)
+            self.assertTrue(all(len(dict(self.server_params(i))['activity_id__in']) <= 100 for i in range(5)))
+            self.assertEqual([act['activity_id'] for act in qs], expected)
+            self.assertEqual([act['activity_id'] for act in qs[10:15]], expected[10:15])
+            self.assertEqual([act['activity_id'] for act in qs.iterator()], expected)
+            self.assertEqual(len(self.server.requests), 5)
+            names = ','.join('MOLECULE {0}'.format(i) for i in range(1, 101))
+            settings.MAX_BODY_SIZE = 600
+            mols = self.molecule.filter(pref_name__in=names).only('molecule_chembl_id')
+            self.assertEqual(len(list(mols)), 100)
+            self.assertGreater(len(self.server.requests), 6)
+            self.assertTrue(all(len(self.server.requests[i][2]) <= 600 for i in range(5, len(self.server.requests))))
+
+    def test_chunked_in_filter_only(self):
+        activity = QuerySet(model=Model('activity', 'activities', ('json', 'xml'), pk='activity_id'))
+        with override_settings(MAX_IN_VALUES=100):
+            for qs in (self.activity, activity):
+                projected = qs.filter(activity_id__in=list(range(1, 901))).only('standard_type')
+                self.assertEqual(len(projected), 900)
+                records = list(projected)
+                self.assertEqual(len(records), 900)
+                self.assertTrue(all(list(record) == ['standard_type'] for record in records))
+            self.assertIn(['only', 'activity_id'], self.server_params(-1))
+
+    def test_chunked_in_filter_order(self):
+        activity = QuerySet(model=Model('activity', 'activities', ('json', 'xml'), pk='activity_id'))
+        ids = list(range(1000, 0, -1))
+        for ordering, only in (((), ()), (('standard_type',), ()), (('-standard_value',), ()),
+                               (('standard_value', '-standard_type'), ()), (('-standard_type',), ('standard_value',)),
+                               ((), ('standard_type',))):
+            results = []
+            for max_in_values in (1000, 70):
+                with override_settings(MAX_IN_VALUES=max_in_values):
+                    qs = activity.filter(activity_id__in=ids).only(*only)
+                    qs = qs.order_by(*ordering) if ordering else qs
+                    results.append(list(qs))
+            self.assertEqual(results[0], results[1])
+
+    def test_chunked_in_filter_keyset(self):
+        with override_settings(MAX_IN_VALUES=100):
+            qs = self.activity.filter(activity_id__in=list(range(1, 1001))).keyset('activity_id', after=500)
+            self.assertEqual([act['activity_id'] for act in qs], list(range(501, 1001)))
+            self.assertEqual(len(self.server.requests), 10)
+            self.assertEqual([act['activity_id'] for act in qs.query._fetch_page(0, 5, 900)[0]], list(range(901, 906)))
+            records, total_count = qs.query._fetch_page(0, 5, 997)
+            self.assertEqual(([act['activity_id'] for act in records], total_count), ([998, 999, 1000], 3))
+            descending = self.activity.filter(activity_id__in=list(range(1, 1001))).keyset('activity_id', after=11)
+            descending.reverse()
+            self.assertEqual([act['activity_id'] for act in descending], list(range(10, 0, -1)))
+            self.assertEqual(len(self.server.requests), 20)
+
+    def test_chunked_in_filter_many_ids(self):
+        started = time.time()
+        qs = self.activity.filter(activity_id__in=list(range(50000, 0, -1))).order_by('activity_id')
+        self.assertEqual(len(qs), 1000)
+        self.assertEqual([act['activity_id'] for act in qs], list(range(1, 1001)))
+        self.assertEqual([act['activity_id'] for act in qs[500:503]], [501, 502, 503])
+        self.assertEqual(len(self.server.requests), 50)
+        self.assertLess(time.time() - started, 10)
+
+    def test_parallel_get_by_ids(self):
+        with override_settings(MAX_URL_SIZE=120, RECORD_CACHE_MAX_SIZE=0):
+            ids = ['CHEMBL{0}'.format(i) for i in range(100, 0, -3)] + ['CHEMBL404', 'CHEMBL7', 'CHEMBL405']
+            molecule = QuerySet(model=Model('molecule', 'molecules', ('json', 'xml')))
+            mols = molecule.get(ids)
+            self.assertEqual([m['molecule_chembl_id'] for m in mols],
+                             [i for i in ids if i not in ('CHEMBL404', 'CHEMBL405')])
+            self.assertEqual(mols.missing, ['CHEMBL404', 'CHEMBL405'])
+            self.assertGreater(len(self.server.requests), 3)
+            root = self.server.url[:-len('/chembl/api/data')]
+            self.assertTrue(all(len(root + path) <= 120 for _, path, _ in self.server.requests))
+            self.assertEqual(len(set(path for _, path, _ in self.server.requests)), len(self.server.requests))
+
+    def test_get_batching(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from chembl_webresource_client.http_errors import HttpNotFound
+        barrier = threading.Barrier(10)
+
+        def get(i):
+            barrier.wait()
+            try:
+                return self.molecule.get('CHEMBL{0}'.format(i))['pref_name']
+            except HttpNotFound:
+                return None
+
+        with override_settings(GET_BATCHING=True, GET_BATCH_WINDOW=0.5, GET_BATCH_MAX_SIZE=10, OBJECT_CACHE_MAX_SIZE=0,
+                               RECORD_CACHE_MAX_SIZE=0):
+            with ThreadPoolExecutor(10) as pool:
+                names_found = list(pool.map(get, [1, 2, 3, 4, 5, 6, 7, 8, 9, 404]))
+            self.assertEqual(names_found, ['MOLECULE {0}'.format(i) for i in range(1, 10)] + [None])
+            self.assertEqual(len(self.server.requests), 1)
+            self.assertEqual(self.server.requests[0][1].count(';'), 9)
+            self.assertEqual(self.molecule.get('CHEMBL11')['pref_name'], 'MOLECULE 11')
+            self.assertEqual(len(self.server.requests), 2)
+
+    def test_primary_key_from_schema(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from chembl_webresource_client.new_client import client_from_url
+        source = client_from_url(self.server.url + '/spore').source
+        self.assertEqual(source.model.pk, 'src_id')
+        barrier = threading.Barrier(5)
+
+        def get(i):
+            barrier.wait()
+            return source.get(i)['src_short_name']
+
+        with override_settings(GET_BATCHING=True, GET_BATCH_WINDOW=0.5, GET_BATCH_MAX_SIZE=5, OBJECT_CACHE_MAX_SIZE=0,
+                               RECORD_CACHE_MAX_SIZE=0):
+            del self.server.requests[:]
+            with ThreadPoolExecutor(5) as pool:
+                self.assertEqual(list(pool.map(get, range(1, 6))), ['SOURCE{0}'.format(i) for i in range(1, 6)])
+            self.assertEqual(len(self.server.requests), 1)
+            sources = source.get([3, 11, 1])
+            self.assertEqual([s['src_id'] for s in sources], [3, 1])
+            self.assertEqual(sources.missing, [11])
+            self.assertEqual(len(self.server.requests), 2)
+
+    def test_unknown_collection_name(self):
+        molecule = QuerySet(model=Model('molecule', 'molecule_list', ('json', 'xml')))
+        self.assertEqual([m['molecule_chembl_id'] for m in molecule.filter(pref_name='MOLECULE 7')], ['CHEMBL7'])
+        self.assertEqual(len(list(molecule.order_by('molecule_chembl_id')[:30])), 30)
+        molecules = molecule.get(['CHEMBL3', 'CHEMBL1'])
+        self.assertEqual([m['molecule_chembl_id'] for m in molecules], ['CHEMBL3', 'CHEMBL1'])
+
+    def test_object_cache(self):
+        from chembl_webresource_client.object_cache import object_cache
+        with override_settings(CACHING=True, CACHE_BACKEND='memory', RECORD_CACHE_MAX_SIZE=0) as settings:
+            qs = self.activity.filter(standard_type='Ki').order_by('activity_id')
+            first = [act['activity_id'] for act in qs[:50]]
+            hits, misses = object_cache.hits, object_cache.misses
+            self.assertEqual([act['activity_id'] for act in qs[:50]], first)
+            self.assertEqual((object_cache.hits - hits, object_cache.misses - misses), (3, 0))
+            for act in self.activity.filter(standard_type='Ki').order_by('activity_id')[:50]:
+                act['standard_value'] = 'MUTATED'
+            self.assertNotIn('MUTATED', [act['standard_value'] for act in
+                                         self.activity.filter(standard_type='Ki').order_by('activity_id')[:50]])
+            mols = self.molecule.get(['CHEMBL1', 'CHEMBL2'])
+            mols.pop()
+            self.assertEqual(len(self.molecule.get(['CHEMBL1', 'CHEMBL2'])), 2)
+            self.assertEqual(self.molecule.get('CHEMBL3'), self.molecule.get('CHEMBL3'))
+            self.assertEqual(len(self.server.requests), 5)
+            settings.OBJECT_CACHE_MAX_SIZE = 3000
+            self.molecule.get('CHEMBL4')
+            self.assertLessEqual(object_cache.stats()['size'], 3000)
+            self.assertGreater(object_cache.evictions, 0)
+
+    def test_record_cache(self):
+        with override_settings(CACHING=True, CACHE_BACKEND='memory'):
+            self.assertEqual(len(list(self.molecule.filter(pref_name__in='MOLECULE 3,MOLECULE 5'))), 2)
+            self.assertEqual(len(list(self.molecule.only('molecule_chembl_id')[:20])), 20)
+            self.assertEqual(self.molecule.get('CHEMBL5')['pref_name'], 'MOLECULE 5')
+            self.assertEqual(len(self.server.requests), 2)
+            mols = self.molecule.get(['CHEMBL7', 'CHEMBL3', 'CHEMBL404', 'CHEMBL8', 'CHEMBL5'])
+            self.assertEqual([m['molecule_chembl_id'] for m in mols], ['CHEMBL7', 'CHEMBL3', 'CHEMBL8', 'CHEMBL5'])
+            self.assertEqual(self.server.requests[-1][1].split('/')[-1], 'CHEMBL7;CHEMBL404;CHEMBL8')
+            self.assertEqual(len(self.molecule.get(['CHEMBL8', 'CHEMBL7'])), 2)
+            self.assertEqual(len(self.server.requests), 3)
+            self.molecule.get('CHEMBL3')['molecule_structures']['canonical_smiles'] = 'MUTATED'
+            self.molecule.get(['CHEMBL3', 'CHEMBL8'])[0]['molecule_structures']['canonical_smiles'] = 'MUTATED'
+            self.assertEqual(self.molecule.get('CHEMBL3')['molecule_structures']['canonical_smiles'], 'CCCC')
+            self.assertEqual(self.molecule.get(['CHEMBL8', 'CHEMBL3'])[1]['molecule_structures']['canonical_smiles'],
+                             'CCCC')
+            self.assertEqual(len(self.server.requests), 3)
+
+    def test_record_cache_search(self):
+        molecule = QuerySet(model=Model('molecule', 'molecules', ('json', 'xml'), True))
+        with override_settings(CACHING=True, CACHE_BACKEND='memory'):
+            found = list(molecule.search('MOLECULE 7'))
+            self.assertEqual(len(found), 11)
+            self.assertTrue(all('score' in mol for mol in found))
+            self.assertEqual(self.molecule.get('CHEMBL7'), {'molecule_chembl_id': 'CHEMBL7', 'pref_name': 'MOLECULE 7',
+                                                            'molecule_structures': {'canonical_smiles': 'CCCCCCCC'}})
+            self.assertEqual(len(self.molecule.get(['CHEMBL70', 'CHEMBL79'])), 2)
+            self.assertEqual(len(self.server.requests), 1)
+
+    def test_negative_cache(self):
+        from requests.exceptions import RetryError
+        from chembl_webresource_client.http_errors import HttpNotFound
+        from chembl_webresource_client.object_cache import negative_cache
+        with override_settings(CACHING=True, CACHE_BACKEND='memory', TOTAL_RETRIES=0):
+            for _ in range(2):
+                self.assertRaises((HttpNotFound, RetryError), self.molecule.get, 'CHEMBL404')
+                self.assertEqual(len(self.molecule.get(['CHEMBL404', 'CHEMBL405', 'CHEMBL1'])), 1)
+                self.assertEqual(len(self.molecule.filter(pref_name='JUNK')), 0)
+            self.assertEqual(len(self.server.requests), 3)
+            self.assertEqual(self.server.requests[1][1].split('/')[-1], 'CHEMBL405;CHEMBL1')
+            negative_cache.clear()
+            self.assertRaises((HttpNotFound, RetryError), self.molecule.get, 'CHEMBL404')
+            self.assertEqual(len(self.server.requests), 4)
+
+    def test_cache_policy_expire(self):
+        with override_settings(CACHING=True, CACHE_BACKEND='memory', CACHE_POLICIES={'molecule': {'expire': 1}}):
+            for _ in range(2):
+                self.assertEqual(len(self.molecule.filter(pref_name__in='MOLECULE 3,MOLECULE 5')), 2)
+                self.assertEqual(self.molecule.get('CHEMBL7')['pref_name'], 'MOLECULE 7')
+                self.assertEqual(len(list(self.activity.filter(standard_type='Ki')[:5])), 5)
+            self.assertEqual(len(self.server.requests), 3)
+            time.sleep(1.2)
+            self.assertEqual(len(self.molecule.filter(pref_name__in='MOLECULE 3,MOLECULE 5')), 2)
+            self.assertEqual(self.molecule.get('CHEMBL7')['pref_name'], 'MOLECULE 7')
+            self.assertEqual(len(list(self.activity.filter(standard_type='Ki')[:5])), 5)
+            self.assertEqual(len(self.server.requests), 5)
+
+    def test_default_caching(self):
+        from chembl_webresource_client.session import get_cache, close_sessions
+        from chembl_webresource_client.object_cache import object_cache, record_cache, negative_cache
+        with override_settings(CACHING=True, CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'default')):
+            qs = self.activity.filter(standard_type='Ki').order_by('activity_id')
+            first = [act['activity_id'] for act in qs[:20]]
+            self.assertEqual([act['activity_id'] for act in qs[:20]], first)
+            self.assertEqual(len(self.molecule.filter(pref_name__in='MOLECULE 3,MOLECULE 5')), 2)
+            self.assertEqual(self.molecule.get('CHEMBL3')['pref_name'], 'MOLECULE 3')
+            for _ in range(2):
+                self.assertEqual(len(self.molecule.get(['CHEMBL404', 'CHEMBL1'])), 1)
+                self.assertEqual(len(self.molecule.filter(pref_name='JUNK')), 0)
+            self.assertEqual(len(self.server.requests), 4)
+            self.assertGreater(object_cache.stats()['hits'], 0)
+            self.assertGreater(record_cache.stats()['hits'], 0)
+            self.assertGreater(negative_cache.stats()['hits'], 0)
+            close_sessions()
+            object_cache.clear()
+            record_cache.clear()
+            self.assertEqual([act['activity_id'] for act in qs[:20]], first)
+            self.assertEqual(self.molecule.get('CHEMBL3')['pref_name'], 'MOLECULE 3')
+            self.assertEqual(len(self.server.requests), 5)
+            self.assertGreater(len(get_cache().responses), 0)
+
+    def test_lfu_eviction(self):
+        from chembl_webresource_client.cache_backends import BoundedMemoryDict
+        storage = BoundedMemoryDict(eviction='lfu')
+        storage['a'] = 'x' * 100
+        storage.max_size = storage.total_size * 2
+        storage['b'] = 'y' * 100
+        storage['a'], storage['a']
+        storage['c'] = 'z' * 100
+        self.assertEqual(sorted(storage), ['a', 'c'])
+        storage['c'], storage['c'], storage['c']
+        storage['d'] = 'w' * 100
+        self.assertEqual(sorted(storage), ['c', 'd'])
+        self.assertEqual(storage.evictions, 2)
+
+    def test_canonical_requests(self):
+        a = self.activity.filter(standard_type='Ki').filter(activity_id__in='7,4,1,4')
+        a = a.only('standard_type', 'activity_id')
+        b = self.activity.filter(activity_id__in='1,4,7').filter(standard_type='Ki')
+        b = b.only('activity_id', 'standard_type')
+        c = self.activity.filter(activity_id__in=[7, 1, 4, 1])
+        self.assertEqual(a.query._prepare_url_params(), b.query._prepare_url_params())
+        self.assertEqual([act['activity_id'] for act in a], [1, 4, 7])
+        self.assertEqual([act['activity_id'] for act in b], [1, 4, 7])
+        self.assertEqual(self.server.requests[0][2], self.server.requests[1][2])
+        self.assertIn(('activity_id__in', [1, 4, 7]), c.query._prepare_url_params())
+        self.assertEqual(len(list(c)), 3)
+
+    def test_release_invalidation(self):
+        from chembl_webresource_client.release import read_release_marker
+        with override_settings(CACHING=True, RELEASE_AWARE_CACHING=True, CACHE_EXPIRE=0, OBJECT_CACHE_MAX_SIZE=0,
+                               RECORD_CACHE_MAX_SIZE=0) as settings:
+            for _ in range(3):
+                self.molecule.get('CHEMBL9')
+            self.assertEqual([r[1].split('/')[-1] for r in self.server.requests], ['status.json', 'CHEMBL9'])
+            self.assertEqual(read_release_marker(), 'ChEMBL_99')
+            self.server.release = 'ChEMBL_100'
+            self.molecule.get('CHEMBL9')
+            self.assertEqual(len(self.server.requests), 2)
+            settings.RELEASE_CHECK_INTERVAL = 0
+            self.molecule.get('CHEMBL9')
+            self.molecule.get('CHEMBL10')
+            self.assertEqual([r[1].split('/')[-1] for r in self.server.requests[2:]],
+                             ['status.json', 'CHEMBL9', 'status.json', 'CHEMBL10'])
+            self.assertEqual(read_release_marker(), 'ChEMBL_100')
+
+    def test_release_check_data_urls(self):
+        from chembl_webresource_client.session import get_session
+        host = self.server.url.rsplit('/chembl/', 1)[0]
+        with override_settings(CACHING=True, RELEASE_AWARE_CACHING=True, RELEASE_CHECK_INTERVAL=0,
+                               CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'release')):
+            get_session(host + '/chembl/api/utils/spore')
+            get_session(host + '/unichem/legacy/rest')
+            get_session(self.server.url + 'base/molecule')
+            self.assertEqual(self.server.requests, [])
+            get_session(self.server.url)
+            get_session(self.server.url + '/molecule')
+            self.assertEqual([r[1].split('/')[-1] for r in self.server.requests], ['status.json', 'status.json'])
+
+    def test_cache_policies(self):
+        from chembl_webresource_client.cache_policies import urls_expire_after, resource_from_url
+        policies = {'molecule': {'expire': -1}, 'activity': {'max_entry_size': 100}, 'search': {'cache': False}}
+        with override_settings(CACHING=True, CACHE_EXPIRE=0, CACHE_BACKEND='memory', CACHE_POLICIES=policies):
+            pattern, = [p for p, expire in urls_expire_after().items() if expire == -1]
+            self.assertTrue(pattern.search(self.server.url + '/molecule/CHEMBL1.json'))
+            self.assertFalse(pattern.search(self.server.url + '/molecule_form/CHEMBL1.json'))
+            self.assertEqual(resource_from_url(self.server.url + '/molecule/search.json?q=x'), ('molecule', True))
+            self.molecule.get('CHEMBL1')
+            self.molecule.get('CHEMBL1')
+            list(self.activity[:5])
+            list(self.activity[:5])
+            self.assertEqual([r[1].split('/')[-1] for r in self.server.requests], ['CHEMBL1', 'activity.json',
+                                                                                  'activity.json'])
+
+    def test_cache_policy_in_process(self):
+        from chembl_webresource_client.session import get_cache
+        from chembl_webresource_client.object_cache import object_cache, record_cache
+        policies = {'molecule': {'backend': 'memory', 'object_cache': False}}
+        with override_settings(CACHING=True, CACHE_POLICIES=policies):
+            molecule = QuerySet(model=Model('molecule', 'molecules', ('json', 'xml')))
+            self.assertEqual(molecule.get('CHEMBL1')['pref_name'], 'MOLECULE 1')
+            self.assertEqual(len(list(molecule.filter(pref_name='MOLECULE 2'))), 1)
+            self.assertEqual((object_cache.stats()['entries'], record_cache.stats()['entries']), (0, 0))
+            molecule.get('CHEMBL1')
+            self.assertEqual(len(self.server.requests), 2)
+            self.assertGreater(len(get_cache('memory').responses), 0)
+            Settings.Instance().clear_cache()
+            self.assertEqual(len(get_cache('memory').responses), 0)
+            molecule.get('CHEMBL1')
+            self.assertEqual(len(self.server.requests), 3)
+
+    def test_compressed_cache(self):
+        from chembl_webresource_client.session import get_cache, close_sessions
+        from chembl_webresource_client.compression import compress_cache, compress, decompress
+        self.assertEqual(decompress(compress(b'abc' * 100, 'zstd')), b'abc' * 100)
+        self.assertEqual(decompress(b'abc'), b'abc')
+        with override_settings(CACHING=True, CACHE_COMPRESSION=None,
+                               CACHE_NAME=os.path.join(tempfile.mkdtemp(), 'compressed'),
+                               OBJECT_CACHE_MAX_SIZE=0, RECORD_CACHE_MAX_SIZE=0) as settings:
+            qs = self.activity.order_by('activity_id').page_size(500)
+            expected = list(qs)
+            raw_size = get_cache().responses.total_size
+            settings.CACHE_COMPRESSION = 'zlib'
+            self.assertEqual(compress_cache(get_cache()), 2)
+            self.assertLess(get_cache().responses.total_size, raw_size / 4)
+            close_sessions()
+            del self.server.requests[:]
+            self.assertEqual(list(qs), expected)
+            self.assertEqual(self.server.requests, [])
+
+    def test_lazy_imports(self):
+        import sys
+        import subprocess
+        code = ("import sys; import chembl_webresource_client.new_client, chembl_webresource_client.utils; "
+                "print(sorted(m for m in ('requests', 'requests_cache', 'pkg_resources') if m in sys.modules))")
+        out = subprocess.check_output([sys.executable, '-c', code], env=dict(os.environ, HOME=tempfile.mkdtemp()))
+        self.assertEqual(out.decode().strip(), '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
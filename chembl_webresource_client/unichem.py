@@ -3,29 +3,23 @@ __author__ = 'mnowotka'
 from chembl_webresource_client.settings import Settings
 
 import re
-import os
 import logging
-import requests
-import requests_cache
-import mimetypes
 from chembl_webresource_client.http_errors import handle_http_error
-from requests.packages.urllib3.util import Retry
+from chembl_webresource_client.http_errors import is_not_found
+from chembl_webresource_client.session import get_session
+from chembl_webresource_client.object_cache import get_negative_cache
+from chembl_webresource_client.object_cache import remember_not_found
+from chembl_webresource_client.object_cache import check_negative
 
 inchi_key_regex = re.compile('[A-Z]{14}-[A-Z]{10}-[A-Z]')
 
 #-----------------------------------------------------------------------------------------------------------------------
 
-mimetypes.init()
-
-#-----------------------------------------------------------------------------------------------------------------------
-
 class UniChemClient(object):
 
 #-----------------------------------------------------------------------------------------------------------------------
 
     def __init__(self):
-        self.session = None
-        self._get_session()
         self.base_url = Settings.Instance().UNICHEM_URL
         self.timeout = Settings.Instance().NEW_CLIENT_TIMEOUT
         self.logger = logging.getLogger(__name__)
@@ -33,34 +27,29 @@ class UniChemClient(object):
 #-----------------------------------------------------------------------------------------------------------------------
 
     def _get_session(self):
-        s = Settings.Instance()
-        if not self.session:
-            retry = Retry(total=s.TOTAL_RETRIES, backoff_factor=s.BACKOFF_FACTOR,
-                    status_forcelist=(list(range(400, 421)) + list(range(500, 505))))
-            size = s.CONCURRENT_SIZE
-            adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size, pool_block=True,
-                max_retries=retry)
-            home_directory = os.path.expanduser('~')
-            self.session = requests_cache.CachedSession(os.path.join(home_directory, s.CACHE_NAME), backend='sqlite',
-                expire_after=s.CACHE_EXPIRE, fast_save=s.FAST_SAVE,
-                allowable_methods=('GET', 'POST'),
-                include_get_headers=True) if s.CACHING else requests.Session()
-            if s.PROXIES:
-                self.session.proxies = s.PROXIES
-            self.session.mount('http://', adapter)
-            self.session.mount('https://', adapter)
-        return self.session
+        return get_session(self.base_url)
 
 #-----------------------------------------------------------------------------------------------------------------------
 
     def _get_results(self, url):
-        with self._get_session() as session:
-                res = session.get(url, timeout=self.timeout)
-                self.logger.info(res.url)
-                self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
-                if not res.ok:
-                    handle_http_error(res)
-                return res.json()
+        negative = get_negative_cache()
+        empty = check_negative(negative, url)
+        if empty is not None:
+            return type(empty)()
+        try:
+            res = self._get_session().get(url, timeout=self.timeout)
+            self.logger.info(res.url)
+            self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
+            if not res.ok:
+                handle_http_error(res)
+        except Exception as e:
+            if negative is not None and is_not_found(e):
+                remember_not_found(negative, url, e)
+            raise
+        ret = res.json()
+        if negative is not None and not ret and isinstance(ret, (list, dict)):
+            negative.put(url, ret, len(res.content))
+        return ret
 
 #-----------------------------------------------------------------------------------------------------------------------
 
@@ -167,4 +156,8 @@ class UniChemClient(object):
 
 #-----------------------------------------------------------------------------------------------------------------------
 
-unichem_client = UniChemClient()
\ No newline at end of file
+def __getattr__(name):
+    if name == 'unichem_client':
+        globals()[name] = UniChemClient()
+        return globals()[name]
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
\ No newline at end of file
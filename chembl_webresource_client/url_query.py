@@ -6,12 +6,284 @@ from xml.dom.minidom import parseString
 
 from urllib.parse import urlencode
 from urllib.parse import quote
+from urllib.parse import unquote
+import re
+import copy
+import time
+import json
 import logging
 import mimetypes
+import threading
+from collections import deque
+from collections import OrderedDict
+from itertools import chain
+from itertools import islice
+from itertools import product
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from chembl_webresource_client.http_errors import handle_http_error
+from chembl_webresource_client.http_errors import HttpNotFound
+from chembl_webresource_client.http_errors import is_not_found
+from chembl_webresource_client.object_cache import get_object_cache
+from chembl_webresource_client.object_cache import get_record_cache
+from chembl_webresource_client.object_cache import get_negative_cache
+from chembl_webresource_client.object_cache import remember_not_found
+from chembl_webresource_client.object_cache import check_negative
+from chembl_webresource_client.cache_policies import get_cache_policy
 
-mimetypes.init()
-mimetypes.add_type('application/json', '.json')
+_mimetypes_initialised = False
+
+
+def _get_mime_type(frmt):
+    global _mimetypes_initialised
+    if not _mimetypes_initialised:
+        mimetypes.init()
+        mimetypes.add_type('application/json', '.json')
+        _mimetypes_initialised = True
+    return mimetypes.types_map['.' + frmt]
+
+
+_read_ahead_executor = None
+
+
+def _get_read_ahead_executor():
+    global _read_ahead_executor
+    if _read_ahead_executor is None:
+        _read_ahead_executor = ThreadPoolExecutor(max_workers=Settings.Instance().SCAN_WORKERS)
+    return _read_ahead_executor
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class AdaptivePageSize(object):
+    """
+    Hill-climbing page size for one resource. Every page fetched from the server reports its size in records
+    and bytes and how long it took; the page size doubles while pages are well within the time and payload
+    budget and the throughput (records per second) keeps improving, and halves when a page goes over budget
+    or the smaller size was measurably faster.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.rates = {}
+        self.lock = threading.Lock()
+
+    def observe(self, limit, records, size_bytes, elapsed):
+        s = Settings.Instance()
+        with self.lock:
+            if limit != self.size or records < limit:
+                return
+            rate = records / max(elapsed, 1e-6)
+            previous = self.rates.get(limit)
+            self.rates[limit] = rate if previous is None else (previous + rate) / 2
+            smaller = self.rates.get(limit // 2)
+            bigger = self.rates.get(limit * 2)
+            if elapsed > s.ADAPTIVE_TARGET_TIME or size_bytes > s.ADAPTIVE_MAX_BYTES or \
+                    (smaller is not None and smaller > self.rates[limit] * 1.1):
+                self.size = max(s.MIN_PAGE_SIZE, limit // 2)
+            elif elapsed < s.ADAPTIVE_TARGET_TIME / 2 and size_bytes < s.ADAPTIVE_MAX_BYTES / 2 and \
+                    (bigger is None or bigger > self.rates[limit]):
+                self.size = min(s.MAX_PAGE_SIZE, limit * 2)
+
+
+_page_sizers = {}
+_page_sizers_lock = threading.Lock()
+
+
+def get_page_sizer(resource_url):
+    with _page_sizers_lock:
+        if resource_url not in _page_sizers:
+            _page_sizers[resource_url] = AdaptivePageSize(Settings.Instance().MAX_LIMIT)
+        return _page_sizers[resource_url]
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class GetBatcher(object):
+    """
+    Micro-batching of single id lookups for one resource, enabled by `Settings.GET_BATCHING`: `get` calls for
+    single ids made by different threads within `GET_BATCH_WINDOW` seconds of each other are sent as one `/set/`
+    request. The first call of a batch waits for the others (until the window ends or `GET_BATCH_MAX_SIZE` ids
+    are collected), makes the request and hands every caller its record, so no call waits longer than the window
+    plus one request.
+    """
+
+    def __init__(self, query):
+        self.query = query.clone()
+        self.condition = threading.Condition()
+        self.batch = None
+
+    def get(self, id):
+        s = Settings.Instance()
+        with self.condition:
+            batch = self.batch
+            leader = batch is None
+            if leader:
+                batch = self.batch = OrderedDict()
+            future = batch.setdefault(str(id), Future())
+            if len(batch) >= s.GET_BATCH_MAX_SIZE:
+                self.batch = None
+                self.condition.notify_all()
+        if leader:
+            deadline = time.time() + s.GET_BATCH_WINDOW
+            with self.condition:
+                while self.batch is batch and time.time() < deadline:
+                    self.condition.wait(deadline - time.time())
+                if self.batch is batch:
+                    self.batch = None
+            self._run(batch)
+        # callers asking for the same id share the future, each of them gets its own record
+        return copy.deepcopy(future.result())
+
+    def _run(self, batch):
+        query = self.query
+        try:
+            records = query._get_set(list(batch), {'Accept': _get_mime_type('json')})
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        by_id = dict((str(query._record_id(record)), record) for record in records)
+        negative = query._get_negative_cache()
+        for id, future in batch.items():
+            if id in by_id:
+                future.set_result(dict(by_id[id]))
+            elif not set(by_id) <= set(batch):
+                # some ids aren't primary keys (e.g. InChI keys), so they are looked up one by one
+                try:
+                    future.set_result(query._get_one(id))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                error = HttpNotFound(query.base_url + '/' + quote(id), 'Not found')
+                if negative is not None:
+                    remember_not_found(negative, (query.base_url, id), error)
+                future.set_exception(error)
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(query):
+    key = (query.base_url, query.cache_backend, query.timeout)
+    with _batchers_lock:
+        if key not in _batchers:
+            _batchers[key] = GetBatcher(query)
+        return _batchers[key]
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def _unique(values):
+    values = list(values)
+    try:
+        return list(dict.fromkeys(values))
+    except TypeError:
+        # unhashable values, e.g. filters with lists of values
+        ret = []
+        for value in values:
+            if value not in ret:
+                ret.append(value)
+        return ret
+
+
+def _canonical_value(key, value):
+    if key.endswith('__in'):
+        if isinstance(value, (list, tuple)):
+            return sorted(_unique(value), key=str)
+        return quote(','.join(sorted(set(unquote(str(value)).split(',')))))
+    if isinstance(value, str):
+        return quote(unquote(value))
+    return value
+
+
+def canonical_filters(filters):
+    """
+    Returns the filters in a canonical form, so equivalent queries result in the same request (and cache entries)
+    no matter in which order the filters were added: strings are quoted the same way, `__in` values are sorted
+    and deduplicated and repeated filters are dropped. The filters themselves are sorted by name.
+    """
+    canonical = _unique((key, _canonical_value(key, value)) for key, value in filters)
+    return sorted(canonical, key=lambda f: (f[0], str(f[1])))
+
+
+def _in_values(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return unquote(str(value)).split(',')
+
+
+def _split_in_values(value, max_values, max_bytes):
+    """
+    Splits the value of an `__in` filter into chunks of at most `max_values` values taking about `max_bytes` in
+    the request body. Comma separated values stay comma separated.
+    """
+    joined = not isinstance(value, (list, tuple))
+    chunks, chunk, size = [], [], 0
+    for item in _in_values(value):
+        item_size = len(quote(str(item))) + 3 if joined else len(json.dumps(item)) + 2
+        if chunk and (len(chunk) >= max_values or size + item_size > max_bytes):
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(item)
+        size += item_size
+    if chunk:
+        chunks.append(chunk)
+    return [quote(','.join(str(item) for item in chunk)) for chunk in chunks] if joined else chunks
+
+
+def _field_value(record, field):
+    for part in field.split('__'):
+        record = record.get(part) if isinstance(record, dict) else None
+    return record
+
+
+def _sort_value(value):
+    """
+    Sort key ordering field values the way the web services do: numbers as numbers, also when they come as
+    strings (e.g. standard_value), before any text. None is dealt with by the caller.
+    """
+    if isinstance(value, str):
+        try:
+            return 0, float(value), ''
+        except ValueError:
+            return 1, 0, value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 0, value, ''
+    return 1, 0, str(value)
+
+
+def _pk_value(value):
+    # primary keys are numbers or ids like CHEMBL25, both ordered by their number
+    if isinstance(value, str):
+        return tuple(int(part) if part.isdigit() else part for part in re.split(r'(\d+)', value))
+    return (value,)
+
+
+def _is_empty(value):
+    """Tells whether a decoded response (a `/set` result or a (records, total count) page) found nothing."""
+    if isinstance(value, tuple):
+        return value[1] == 0
+    return isinstance(value, list) and not value
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class RecordList(list):
+    """
+    Records returned by `get` for a list of ids, in the order of the ids. `missing` lists the ids nothing was
+    found for, or is None when the records can't be matched to the ids (formats other than json, or ids that
+    aren't primary keys, e.g. InChI keys).
+    """
+
+    def __init__(self, records=(), missing=None):
+        super(RecordList, self).__init__(records)
+        self.missing = missing
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -47,6 +319,15 @@ class UrlQuery(Query):
         self.only = []
         self.frmt = 'json'
         self.ordering = []
+        self.read_ahead = Settings.Instance().READ_AHEAD
+        self.adaptive_page_size = False
+        self.keyset = None
+        self.keyset_after = None
+        self.cache_backend = get_cache_policy(model.name).get('backend')
+        self._prefetched = {}
+        self._plan = None
+        # (key, records) of the last split query merged, shared with clones (e.g. the one `iterator` makes)
+        self._merged = [None]
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -125,8 +406,24 @@ class UrlQuery(Query):
         result.frmt = self.frmt
         result.ordering = self.ordering[:]
         result.only = self.only[:]
+        result.read_ahead = self.read_ahead
+        result.adaptive_page_size = self.adaptive_page_size
+        result.keyset = self.keyset
+        result.keyset_after = self.keyset_after
+        result.cache_backend = self.cache_backend
+        result._merged = self._merged
+        result._plan = None
         return result
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_prefetched'] = {}
+        state['_merged'] = [None]
+        state['_plan'] = None
+        return state
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def __iter__(self):
@@ -209,6 +506,8 @@ class UrlQuery(Query):
     def set_ordering(self, *fields):
         if not self.allows_list:
             return
+        if self.keyset and list(fields) not in ([self.keyset], ['-' + self.keyset]):
+            raise Exception('Keyset pagination on {0} requires ordering by {0} or -{0} only'.format(self.keyset))
         self.ordering = fields
         self.set_limits(None, None)
 
@@ -220,6 +519,32 @@ class UrlQuery(Query):
         self.only = fields
         self.set_limits(None, None)
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def set_keyset(self, field, after=None):
+        if not self.allows_list:
+            return
+        self.keyset = field
+        self.keyset_after = after
+        self.ordering = [field]
+        self.set_limits(None, None)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def set_page_size(self, size):
+        if not self.allows_list:
+            return
+        if size == 'auto':
+            self.adaptive_page_size = True
+            size = get_page_sizer(self.base_url).size
+        else:
+            self.adaptive_page_size = False
+        self.limit = max(1, min(int(size), Settings.Instance().MAX_PAGE_SIZE))
+        self.current_chunk = None
+        self.current_index = 0
+        self.current_page = 0
+        self._prefetched = {}
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def reverse(self):
@@ -293,87 +618,445 @@ class UrlQuery(Query):
         if self.frmt in ('mol', 'sdf'):
             headers = {'Accept': 'chemical/x-mdl-molfile'}
         else:
-            headers = {'Accept': mimetypes.types_map['.'+self.frmt]}
+            headers = {'Accept': _get_mime_type(self.frmt)}
         self.logger.info('headers:')
         self.logger.info(headers)
+        records = self._get_record_cache()
         if not isinstance(ids, (list, tuple)):
-            url = self.base_url + '/'  + quote(str(ids))
-            if self.frmt in ('mol', 'sdf'):
-                url += '.sdf'
-            if len(url) > self.max_url_size:
-                raise Exception('URL {0} is longer than allowed {1} characters'.format(url, self.max_url_size))
-            with self._get_session() as session:
-                res = session.get(url, headers=headers, timeout=self.timeout)
-            self.logger.info(res.url)
-            self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
-            if not res.ok:
-                handle_http_error(res)
-            if self.frmt == 'json':
-                return res.json()
-            elif self.frmt in ('svg+xml', 'xml', 'html', 'svg', 'txt', 'mol', 'sdf'):
-                return res.text
-            return res.content
+            record = records.get((self.base_url, str(ids))) if records is not None else None
+            if record is not None:
+                return dict(record)
+            check_negative(self._get_negative_cache(), (self.base_url, str(ids)))
+            if Settings.Instance().GET_BATCHING and self.frmt == 'json' and self.allows_multiple:
+                return get_batcher(self).get(ids)
+            return self._get_one(ids, headers)
         if not self.allows_multiple:
             self.logger.error("This resource doesn't accept multiple ids.")
             return
-        ret = []
-        url = self.base_url + '/set/'
+        if records is None:
+            return self._in_order(ids, self._get_set(ids, headers))
+        negative = self._get_negative_cache()
+        found = {}
+        for id in ids:
+            record = records.get((self.base_url, str(id)))
+            if record is not None:
+                found[str(id)] = record
+        missing = [id for id in OrderedDict.fromkeys(ids) if str(id) not in found and
+                   (negative is None or negative.get((self.base_url, str(id))) is None)]
+        if missing:
+            fetched = dict((str(self._record_id(record)), record) for record in self._get_set(missing, headers))
+            if not set(fetched) <= set(str(id) for id in missing):
+                # some ids aren't primary keys (e.g. InChI keys), so the records can't be matched to them
+                return RecordList(self._get_set(ids, headers))
+            found.update(fetched)
+            if negative is not None:
+                for id in missing:
+                    if str(id) not in fetched:
+                        remember_not_found(negative, (self.base_url, str(id)),
+                                           HttpNotFound(self.base_url + '/' + quote(str(id)), 'Not found'))
+        return RecordList([dict(found[str(id)]) for id in ids if str(id) in found],
+                          [id for id in OrderedDict.fromkeys(ids) if str(id) not in found])
+
+    def _get_one(self, id, headers=None):
+        headers = headers or {'Accept': _get_mime_type(self.frmt)}
+        url = self.base_url + '/'  + quote(str(id))
+        if self.frmt in ('mol', 'sdf'):
+            url += '.sdf'
         if len(url) > self.max_url_size:
             raise Exception('URL {0} is longer than allowed {1} characters'.format(url, self.max_url_size))
+        negative = self._get_negative_cache()
+        try:
+            ret = self._cached(('GET', url, headers['Accept']), self._request_resource, url, headers)
+        except Exception as e:
+            if negative is not None and is_not_found(e):
+                remember_not_found(negative, (self.base_url, str(id)), e)
+            raise
+        return dict(ret) if isinstance(ret, dict) else ret
+
+    def _in_order(self, ids, records):
+        """Puts json records fetched for `ids` in the order of the ids, when they can be matched by primary key."""
+        if self.frmt != 'json':
+            return RecordList(records)
+        by_id = dict((str(self._record_id(record)), record) for record in records)
+        if not set(by_id) <= set(str(id) for id in ids):
+            return RecordList(records)
+        return RecordList([dict(by_id[str(id)]) for id in ids if str(id) in by_id],
+                          [id for id in OrderedDict.fromkeys(ids) if str(id) not in by_id])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _set_urls(self, ids):
+        """Splits `ids` into as few `/set/` urls as possible, none of them longer than `max_url_size`."""
+        urls = []
+        prefix = self.base_url + '/set/'
+        # leaves room for the format specifier
+        max_size = self.max_url_size - 12 if self.frmt in ('mol', 'sdf') else self.max_url_size
+        url = None
         for id in ids:
-            if url.endswith('/'):
-                url += quote(str(id))
-                if len(url) > self.max_url_size:
-                    raise Exception('URL {0} is longer than allowed {1} characters'.format(url, self.max_url_size))
-            else:
-                old_url = url
+            if url is not None and len(url) + 1 + len(quote(str(id))) <= max_size:
                 url += ';' + quote(str(id))
-                if len(url) > self.max_url_size - 12: # Allow for format specifier to be appended
-                    with self._get_session() as session:
-                        if self.frmt in ('mol', 'sdf'):
-                            old_url += '?format=' + self.frmt
-                        res = session.get(old_url, headers=headers, timeout=self.timeout)
-                    self.logger.info(res.url)
-                    self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
-                    if not res.ok:
-                        handle_http_error(res)
-                    self._gather_results(res, ret)
-        with self._get_session() as session:
-            if self.frmt in ('mol', 'sdf'):
-                url += '?format=' + self.frmt
-            res = session.get(url, headers=headers, timeout=self.timeout)
+                continue
+            if url is not None:
+                urls.append(url)
+            url = prefix + quote(str(id))
+            if len(url) > max_size:
+                raise Exception('URL {0} is longer than allowed {1} characters'.format(url, self.max_url_size))
+        if url is not None:
+            urls.append(url)
+        if self.frmt in ('mol', 'sdf'):
+            urls = [url + '?format=' + self.frmt for url in urls]
+        return urls
+
+    def _get_set(self, ids, headers):
+        """
+        Fetches the records with the given ids from `/set/` urls. When the ids need more than one url, the urls
+        are requested concurrently by at most `SCAN_WORKERS` threads and their records returned in url order.
+        """
+        urls = self._set_urls(ids)
+
+        def fetch(url):
+            return self._cached(('GET', url, headers['Accept']), self._request_set, url, headers)
+
+        if len(urls) < 2:
+            return list(chain.from_iterable(fetch(url) for url in urls))
+        s = Settings.Instance()
+        with ThreadPoolExecutor(max_workers=min(s.SCAN_WORKERS, s.CONCURRENT_SIZE, len(urls))) as executor:
+            return list(chain.from_iterable(executor.map(fetch, urls)))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _cached(self, key, request, *args):
+        """
+        Returns the decoded response for the request identified by `key` from the in-process object cache, or
+        performs it with `request(*args)`, which must return the decoded response along with its size in bytes.
+        """
+        policy = self._get_cache_policy()
+        cache = get_object_cache() if self._in_process_caching(policy) else None
+        negative = self._get_negative_cache()
+        value = check_negative(negative, key)
+        if value is None and cache is not None:
+            value = cache.get(key)
+        if value is None:
+            value, size = request(*args)
+            if negative is not None and _is_empty(value):
+                # nothing found is only remembered briefly, in case it's about to be added
+                negative.put(key, value, size)
+            elif cache is not None and size <= policy.get('max_entry_size', size):
+                cache.put(key, value, size, policy.get('expire'))
+        return value
+
+    def _request_resource(self, url, headers):
+        res = self._get_session().get(url, headers=headers, timeout=self.timeout)
         self.logger.info(res.url)
         self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
-        if res.ok:
-            self._gather_results(res, ret)
-        else:
+        if not res.ok:
             handle_http_error(res)
-        return ret
+        if self.frmt == 'json':
+            record = res.json()
+            self._remember_records([record], len(res.content))
+            return record, len(res.content)
+        elif self.frmt in ('svg+xml', 'xml', 'html', 'svg', 'txt', 'mol', 'sdf'):
+            return res.text, len(res.content)
+        return res.content, len(res.content)
+
+    def _request_set(self, url, headers):
+        res = self._get_session().get(url, headers=headers, timeout=self.timeout)
+        self.logger.info(res.url)
+        self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
+        if not res.ok:
+            handle_http_error(res)
+        records = []
+        self._gather_results(res, records)
+        self._remember_records(records, len(res.content))
+        return records, len(res.content)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _get_cache_policy(self):
+        return get_cache_policy(self.model.name, self.base_url.endswith('/search'))
+
+    def _in_process_caching(self, policy=None):
+        policy = self._get_cache_policy() if policy is None else policy
+        return policy.get('cache', True) and policy.get('object_cache', True)
+
+    def _get_negative_cache(self):
+        return get_negative_cache() if self._in_process_caching() else None
+
+    def _get_record_cache(self):
+        return get_record_cache() if self.frmt == 'json' and self._in_process_caching() else None
+
+    def _pk_fields(self):
+        # the primary key named by the schema, e.g. src_id for sources, otherwise the names most resources use
+        pk = getattr(self.model, 'pk', None)
+        return (pk,) if pk else (self.model.name + '_chembl_id', self.model.name + '_id')
+
+    def _record_id(self, record):
+        for field in self._pk_fields():
+            if field in record:
+                return record[field]
+
+    def _remember_records(self, records, size):
+        """
+        Puts complete json records into the record cache under their primary key, so later `get` calls for them
+        don't need a request. Records trimmed by `only` are left out. Search results are the records of the
+        resource plus a relevance `score`, they are kept without it under the url of the resource.
+        """
+        cache = self._get_record_cache()
+        if cache is None or self.only or not records:
+            return
+        search = self.base_url.endswith('/search')
+        base_url = self.base_url[:-len('/search')] if search else self.base_url
+        expire = get_cache_policy(self.model.name).get('expire')
+        for record in records:
+            pk = self._record_id(record)
+            if pk is None:
+                continue
+            if search:
+                record = dict((key, value) for key, value in record.items() if key != 'score')
+            cache.put((base_url, str(pk)), record, size // len(records), expire)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
     def _gather_results(self, request, ret):
         if self.frmt == 'json':
             json_data = request.json()
-            ret.extend(json_data[self.collection_name])
+            ret.extend(self._collection(json_data))
         elif self.frmt in ('mol', 'sdf'):
             sdf_data = request.text.encode('utf-8')
             ret.extend(sdf_data.split(b'$$$$\n')) # Needed to split a bytes object
         else:
             xml = parseString(request.text)
-            ret.extend([e.toxml() for e in xml.getElementsByTagName(self.collection_name)[0].childNodes])
+            ret.extend([e.toxml() for e in self._xml_collection(xml).childNodes])
+
+    def _collection(self, json_data):
+        # a schema bundled with an older release may name the collection differently; a page holds a single list
+        if self.collection_name not in json_data:
+            lists = [v for k, v in json_data.items() if k != 'page_meta' and isinstance(v, list)]
+            if len(lists) == 1:
+                return lists[0]
+        return json_data[self.collection_name]
+
+    def _xml_collection(self, xml):
+        elements = xml.getElementsByTagName(self.collection_name)
+        if not elements:
+            elements = [e for e in xml.documentElement.childNodes if e.nodeType == e.ELEMENT_NODE and
+                        e.tagName != 'page_meta'][:1]
+        return elements[0]
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-    def _prepare_url_params(self):
-        url_params = self.filters[:]
+    def _prepare_url_params(self, offset=None, limit=None, after=None, extra_only=(), seek=True):
+        url_params = canonical_filters(self.filters)
+        if after is None:
+            after = self.keyset_after
+        if self.keyset and after is not None and seek:
+            # descending keyset scans (after reverse() or order_by('-field')) continue below the last key
+            lookup = '__lt' if list(self.ordering) == ['-' + self.keyset] else '__gt'
+            url_params.append((self.keyset + lookup, after))
         url_params.extend(map(lambda x: ('order_by', x), self.ordering))
         if self.only:
-            url_params.extend(map(lambda x: ('only', x), self.only))
-        start = self.start
-        url_params.extend([('limit', self.limit), ('offset', int(start + self.limit * self.current_page))])
+            url_params.extend(map(lambda x: ('only', x), sorted(set(self.only) | set(extra_only))))
+        if offset is None:
+            offset = self.start + self.limit * self.current_page
+        url_params.extend([('limit', limit or self.limit), ('offset', int(offset))])
         return url_params
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _fetch_page(self, offset, limit=None, after=None):
+        """
+        Fetches a single page of results starting at `offset` (and after the `after` key in keyset mode) without
+        touching the iteration state, so it can be safely called from worker threads.
+        Returns a (records, total_count) tuple.
+        """
+        limit = limit or self.limit
+        merged = self._chunked_records(after)
+        if merged is not None:
+            return merged[offset:offset + limit], len(merged)
+        data = self._prepare_url_params(offset, limit, after)
+        records, total_count = self._cached(('POST', self.base_url + '.' + self.frmt, json.dumps(data)),
+                                            self._request_page, data, limit)
+        return list(records), total_count
+
+    def _plan_chunks(self, params):
+        """
+        Returns the parameters of the requests to make instead of one request with `params` (filters, ordering
+        and `only`, without `limit` and `offset`) when its `__in` filters have more than `MAX_IN_VALUES` values
+        or make the request body bigger than `MAX_BODY_SIZE`, None if a single request will do. The offending
+        filters are split into chunks fitting in those limits; with more than one of them every combination of
+        their chunks is requested. Only json results can be merged, other formats are always requested at once.
+        """
+        s = Settings.Instance()
+        if self.frmt != 'json':
+            return None
+        in_filters = [i for i, (key, _) in enumerate(params) if key.endswith('__in')]
+        if len(json.dumps(params)) > s.MAX_BODY_SIZE:
+            oversized = in_filters
+        else:
+            oversized = [i for i in in_filters if len(_in_values(params[i][1])) > s.MAX_IN_VALUES]
+        if not oversized:
+            return None
+        # the body without the values of the filters to split, with room for the limit and offset of any page
+        fixed = len(json.dumps([(key, '' if i in oversized else value) for i, (key, value) in enumerate(params)] +
+                               [('limit', s.MAX_PAGE_SIZE), ('offset', 10 ** 9)]))
+        budget = max((s.MAX_BODY_SIZE - fixed) // len(oversized), 1)
+        splits = [[(i, chunk) for chunk in _split_in_values(params[i][1], s.MAX_IN_VALUES, budget)]
+                  for i in oversized]
+        plans = []
+        for combination in product(*splits):
+            plan = list(params)
+            for i, chunk in combination:
+                plan[i] = (params[i][0], chunk)
+            plans.append(plan)
+        return plans
+
+    def _chunk_plan(self):
+        """
+        Returns (key, plans): the requests `_plan_chunks` splits the query into, None if it needn't be split, and
+        the key identifying the merged result. Canonicalising and splitting a big `__in` filter takes a while, so
+        the plan is computed once and kept until the query changes. Keyset queries are planned without the seek
+        condition, which `_chunked_records` applies to the merged result, so every page of a keyset scan uses it.
+        """
+        # filters are only ever appended to or replaced, so their number and identity tell whether they changed
+        signature = (self.base_url, self.frmt, id(self.filters), len(self.filters), tuple(self.ordering),
+                     tuple(self.only), self.keyset)
+        plan = self._plan
+        if plan is None or plan[0] != signature:
+            params = [param for param in self._prepare_url_params(0, 1, extra_only=self._merge_fields(), seek=False)
+                      if param[0] not in ('limit', 'offset')]
+            plans = self._plan_chunks(params)
+            plan = self._plan = (signature, json.dumps(params) if plans is not None else None, plans)
+        return plan[1], plan[2]
+
+    def _chunked_records(self, after=None):
+        """
+        Returns all the records of a query whose `__in` filters are too big for a single request (see
+        `_plan_chunks`), None for other queries. The chunks are fetched concurrently, page by page, and their
+        records merged: duplicates (records matching several chunks) are dropped by primary key and the
+        ordering of the query is applied to the whole result. Such queries are therefore always fetched as a
+        whole, even to take their length, their first record or a single page. The result is kept with the
+        query, so paging through it (also with keyset pagination, from `after` or the `keyset_after` of the
+        query) or taking its length doesn't repeat the requests.
+        """
+        key, plans = self._chunk_plan()
+        if plans is None:
+            return None
+        merged = self._merged[0]
+        if merged is None or merged[0] != key:
+            merged = self._merged[0] = (key, self._fetch_chunks(plans))
+        if after is None:
+            after = self.keyset_after
+        if self.keyset and after is not None:
+            return self._records_after(merged[1], after)
+        return merged[1]
+
+    def _records_after(self, records, after):
+        """The records of a keyset query following the key `after`, in the order of the query."""
+        descending = list(self.ordering) == ['-' + self.keyset]
+        after = _sort_value(after)
+        for i, record in enumerate(records):
+            value = _field_value(record, self.keyset)
+            if value is not None and (_sort_value(value) < after if descending else _sort_value(value) > after):
+                return records[i:]
+        return []
+
+    def _fetch_chunks(self, plans):
+        s = Settings.Instance()
+        size = s.MAX_PAGE_SIZE
+        url = self.base_url + '.' + self.frmt
+
+        def fetch(plan, offset):
+            data = plan + [('limit', size), ('offset', offset)]
+            return self._cached(('POST', url, json.dumps(data)), self._request_page, data, size)
+
+        self.logger.info('splitting the query into {0} requests'.format(len(plans)))
+        with ThreadPoolExecutor(max_workers=min(s.SCAN_WORKERS, s.CONCURRENT_SIZE)) as executor:
+            firsts = list(executor.map(lambda plan: fetch(plan, 0), plans))
+            rest = [[executor.submit(fetch, plan, offset) for offset in range(size, total_count, size)]
+                    for plan, (_, total_count) in zip(plans, firsts)]
+            pages = [[records] + [future.result()[0] for future in futures]
+                     for (records, _), futures in zip(firsts, rest)]
+        return self._merge(chain.from_iterable(chain.from_iterable(pages)))
+
+    def _merge_fields(self):
+        """
+        Fields the records of split requests need for merging but `only` leaves out: the primary key, when the
+        schema names it, and the fields they are ordered by. They are requested too and removed from the merged
+        records.
+        """
+        if not self.only:
+            return []
+        pk = getattr(self.model, 'pk', None)
+        fields = ([pk] if pk else []) + [field.lstrip('-').split('__')[0] for field in self.ordering]
+        return [field for field in _unique(fields) if field not in self.only]
+
+    def _merge(self, records):
+        seen = set()
+        merged = []
+        for record in records:
+            pk = self._record_id(record)
+            if pk is None:
+                # without the primary key (trimmed by `only`) equal looking records may still be distinct ones
+                merged.append(record)
+            elif pk not in seen:
+                seen.add(pk)
+                merged.append(record)
+        # the web services order by primary key last, so records comparing equal keep that order
+        ids = [self._record_id(record) for record in merged]
+        if None not in ids:
+            merged = [record for _, record in sorted(zip(map(_pk_value, ids), merged), key=lambda pair: pair[0])]
+        for field in reversed(self.ordering):
+            name = field.lstrip('-')
+            values = [_field_value(record, name) for record in merged]
+            keys = [(value is None, _sort_value(value) if value is not None else None) for value in values]
+            order = sorted(range(len(merged)), key=keys.__getitem__, reverse=field.startswith('-'))
+            merged = [merged[i] for i in order]
+        extra = self._merge_fields()
+        if extra:
+            merged = [dict((key, value) for key, value in record.items() if key not in extra) for record in merged]
+        return merged
+
+    def _request_page(self, data, limit):
+        session = self._get_session()
+        started = time.time()
+        res = session.post(self.base_url + '.' + self.frmt, json=data, timeout=self.timeout)
+        elapsed = time.time() - started
+        self.logger.info(res.url)
+        self.logger.info(data)
+        self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
+        if not res.ok:
+            handle_http_error(res)
+        if self.frmt == 'json':
+            json_data = res.json()
+            records = self._collection(json_data)
+            self._remember_records(records, len(res.content))
+            if self.adaptive_page_size and not getattr(res, 'from_cache', False):
+                get_page_sizer(self.base_url).observe(limit, len(records), len(res.content), elapsed)
+            return (records, json_data['page_meta']['total_count']), len(res.content)
+        elif self.frmt in ('mol', 'sdf'):
+            sdf_data = res.text.encode('utf-8')
+            chunk = sdf_data.split(b'$$$$\n')
+            size = len(res.content)
+            res = session.post(self.base_url + '.json', json=data, timeout=self.timeout)
+            self.logger.info(res.url)
+            self.logger.info(data)
+            self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
+            if not res.ok:
+                handle_http_error(res)
+            json_data = res.json()
+            aux_data = self._collection(json_data)
+            for idx, mol in enumerate(aux_data):
+                if not mol['molecule_structures']:
+                    self.logger.info((idx, mol['molecule_chembl_id']))
+                    chunk.insert(idx, None)
+            self.logger.info(aux_data)
+            self.logger.info(chunk)
+            return (chunk, json_data['page_meta']['total_count']), size + len(res.content)
+        xml = parseString(res.text.encode('utf-8'))
+        chunk = [e.toxml() for e in self._xml_collection(xml).childNodes]
+        page_meta = xml.getElementsByTagName('page_meta')[0]
+        return (chunk, int(page_meta.getElementsByTagName('total_count')[0].childNodes[0].data)), len(res.content)
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def get_page(self):
@@ -384,46 +1067,198 @@ class UrlQuery(Query):
             return []
         if not self.current_chunk or self.current_page != int(self.current_index / self.limit):
             self.current_page = int(self.current_index / self.limit)
-            data = self._prepare_url_params()
-            with self._get_session() as session:
-                res = session.post(self.base_url + '.' + self.frmt, json=data, timeout=self.timeout)
-            self.logger.info(res.url)
-            self.logger.info(data)
-            self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
-            if not res.ok:
-                handle_http_error(res)
-            if self.frmt == 'json':
-                json_data = res.json()
-                self.current_chunk = json_data[self.collection_name]
-                self.api_total_count = json_data['page_meta']['total_count']
-            elif self.frmt in ('mol', 'sdf'):
-                sdf_data = res.text.encode('utf-8')
-                self.current_chunk = sdf_data.split(b'$$$$\n')
-                with self._get_session() as session:
-                    res = session.post(self.base_url + '.json', json=data, timeout=self.timeout)
-                self.logger.info(res.url)
-                self.logger.info(data)
-                self.logger.info('From cache: {0}'.format(res.from_cache if hasattr(res, 'from_cache') else False))
-                if not res.ok:
-                    handle_http_error(res)
-                json_data = res.json()
-                self.api_total_count = json_data['page_meta']['total_count']
-                aux_data = json_data[self.collection_name]
-                for idx, mol in enumerate(aux_data):
-                    if not mol['molecule_structures']:
-                        self.logger.info((idx, mol['molecule_chembl_id']))
-                        self.current_chunk.insert(idx, None)
-                self.logger.info(aux_data)
-                self.logger.info(self.current_chunk)
-            else:
-                xml = parseString(res.text.encode('utf-8'))
-                self.current_chunk = [e.toxml() for e in xml.getElementsByTagName(self.collection_name)[0].childNodes]
-                page_meta = xml.getElementsByTagName('page_meta')[0]
-                self.api_total_count = int(page_meta.getElementsByTagName('total_count')[0].childNodes[0].data)
+            self.current_chunk = self._load_page(self.start + self.limit * self.current_page)
         start = self.start
         return self.current_chunk[:(self.stop - start) - self.current_index] if \
             self.stop is not None else self.current_chunk
 
+    def _load_page(self, offset):
+        # the page at `offset`, read ahead in the background if it was asked for, which also requests the next ones
+        future = self._prefetched.pop(self._page_key(offset), None) if self._prefetched else None
+        if future is not None:
+            records, self.api_total_count = future.result()
+        else:
+            records, self.api_total_count = self._fetch_page(offset)
+        if self.read_ahead and self._chunk_plan()[1] is None:
+            self._schedule_read_ahead(offset)
+        return records
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _page_key(self, offset):
+        return self.base_url, self.frmt, str(self._prepare_url_params(offset))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _schedule_read_ahead(self, offset):
+        """
+        Starts fetching the `read_ahead` pages following the one at `offset` in the background, so the network
+        round trips overlap with the consumer working through the current chunk. The pages are fetched from a
+        snapshot of the query, so changing it in the meantime can't mix results. Pages outside of that window
+        (e.g. left over after filters or limits changed) are dropped, which keeps the buffer bounded.
+        """
+        end = self.api_total_count if self.stop is None else min(self.stop, self.api_total_count)
+        snapshot = None
+        wanted = {}
+        for i in range(1, self.read_ahead + 1):
+            next_offset = offset + i * self.limit
+            if next_offset >= end:
+                break
+            key = self._page_key(next_offset)
+            future = self._prefetched.get(key)
+            if future is None:
+                snapshot = snapshot or self.clone()
+                future = _get_read_ahead_executor().submit(snapshot._fetch_page, next_offset)
+            wanted[key] = future
+        for key, future in self._prefetched.items():
+            if key not in wanted:
+                future.cancel()
+        self._prefetched = wanted
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iterate(self, workers=None, window=None):
+        """
+        Returns a generator yielding all records of the query in order. With an adaptive page size and no explicit
+        number of workers pages are fetched one after another, each one as big as the page sizer currently
+        suggests. Keyset queries are always scanned sequentially, see `_iterate_keyset`. Otherwise the pages are
+        fetched concurrently, see `_iterate_parallel`. Queries split because of big `__in` filters are fetched
+        as a whole by `_chunked_records`.
+        """
+        if not self.allows_list:
+            return iter(())
+        merged = self._chunked_records()
+        if merged is not None:
+            self.api_total_count = len(merged)
+            return iter(merged[self.start:self.stop])
+        if self.keyset:
+            return self._iterate_keyset()
+        if self.adaptive_page_size and not workers:
+            return self._iterate_adaptive()
+        if self.adaptive_page_size:
+            self.limit = get_page_sizer(self.base_url).size
+        return self._iterate_parallel(workers, window)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def iterate_pages(self):
+        """
+        Page by page counterpart of iterating over the query: returns a generator yielding the results in lists,
+        fetched with keyset pagination, an adaptive page size or read ahead like the records are.
+        """
+        if not self.allows_list:
+            return iter(())
+        merged = self._chunked_records()
+        if merged is not None:
+            self.api_total_count = len(merged)
+            return iter([page for page in [merged[self.start:self.stop]] if page])
+        if self.keyset:
+            return self._keyset_pages()
+        if self.adaptive_page_size:
+            return self._adaptive_pages()
+        return self._sequential_pages()
+
+    def _sequential_pages(self):
+        offset = self.start
+        while self.stop is None or offset < self.stop:
+            records = self._load_page(offset)
+            records = records if self.stop is None else records[:self.stop - offset]
+            if records:
+                yield records
+            offset += self.limit
+            if not records or offset >= self.api_total_count:
+                return
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _iterate_adaptive(self):
+        for page in self._adaptive_pages():
+            for record in page:
+                yield record
+
+    def _adaptive_pages(self):
+        sizer = get_page_sizer(self.base_url)
+        offset = self.start
+        while self.stop is None or offset < self.stop:
+            limit = sizer.size if self.stop is None else min(sizer.size, self.stop - offset)
+            records, self.api_total_count = self._fetch_page(offset, limit)
+            if records:
+                yield records
+            offset += len(records)
+            if not records or offset >= self.api_total_count:
+                return
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _iterate_keyset(self):
+        """
+        Seek pagination: every page after the first one asks for the records whose key comes after the last one
+        seen (greater, or smaller when the ordering is descending), starting from offset zero, so deep pages cost
+        the same as the first one and records inserted or removed in the meantime don't shift the following pages.
+        `keyset_after` tracks the last key seen.
+        """
+        for page in self._keyset_pages():
+            for record in page:
+                self.keyset_after = record[self.keyset]
+                yield record
+
+    def _keyset_pages(self):
+        if self.frmt != 'json':
+            raise Exception('Keyset pagination requires the json format')
+        field = self.keyset
+        remaining = None if self.stop is None else self.stop - self.start
+        offset = self.start
+        after = self.keyset_after
+        while remaining is None or remaining > 0:
+            size = get_page_sizer(self.base_url).size if self.adaptive_page_size else self.limit
+            limit = size if remaining is None else min(size, remaining)
+            records, total_count = self._fetch_page(offset, limit, after)
+            if self.api_total_count is None:
+                self.api_total_count = total_count
+            if records:
+                after = records[-1][field]
+                yield records
+            if remaining is not None:
+                remaining -= len(records)
+            if len(records) < limit:
+                return
+            offset = 0
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+    def _iterate_parallel(self, workers=None, window=None):
+        """
+        Yields all records of the query in order, fetching the pages following the first one concurrently.
+        The first page tells us the total count, so the remaining offsets are known up front and can be
+        dispatched to `workers` threads sharing the session connection pool. At most `window` pages are
+        in flight or waiting to be consumed at any time, so a slow consumer doesn't buffer the whole result.
+        """
+        s = Settings.Instance()
+        workers = min(workers or s.SCAN_WORKERS, s.CONCURRENT_SIZE)
+        window = max(window or 2 * workers, 1)
+        start = self.start
+        first, total_count = self._fetch_page(start)
+        self.api_total_count = total_count
+        end = total_count if self.stop is None else min(self.stop, total_count)
+        for record in first[:end - start]:
+            yield record
+        offsets = iter(range(start + self.limit, end, self.limit))
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for offset in islice(offsets, window):
+                    pending.append((offset, executor.submit(self._fetch_page, offset)))
+                while pending:
+                    offset, future = pending.popleft()
+                    records, _ = future.result()
+                    for next_offset in islice(offsets, 1):
+                        pending.append((next_offset, executor.submit(self._fetch_page, next_offset)))
+                    for record in records[:end - offset]:
+                        yield record
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
 # ----------------------------------------------------------------------------------------------------------------------
 
     def next_page(self):
@@ -1,32 +1,19 @@
 __author__ = "mnowotka"
 
-import requests
-from requests_cache import CachedSession
 from chembl_webresource_client.spore_client import client_from_url
+from chembl_webresource_client.session import get_session as get_shared_session
 from chembl_webresource_client.settings import Settings
+from chembl_webresource_client.schema_cache import UTILS_SPORE
 
 
 def get_session():
-    s = Settings.Instance()
-    if s.CACHING:
-        session = CachedSession(
-            s.CACHE_NAME,
-            backend="sqlite",
-            fast_save=s.FAST_SAVE,
-            allowable_methods=("GET", "POST"),
-            include_get_headers=True,
-        )
-    else:
-        session = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(
-        pool_connections=s.CONCURRENT_SIZE,
-        pool_maxsize=s.CONCURRENT_SIZE,
-        max_retries=3,
-        pool_block=True,
-    )
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+    # as before, requests to the utils web services are retried three times on connection errors only
+    return get_shared_session(Settings.Instance().UTILS_SPORE_URL, retry=3)
 
 
-utils = client_from_url(Settings.Instance().UTILS_SPORE_URL, session=get_session())
+def __getattr__(name):
+    if name == 'utils':
+        globals()[name] = client_from_url(Settings.Instance().UTILS_SPORE_URL, session=get_session,
+                                          fallback=UTILS_SPORE)
+        return globals()[name]
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
@@ -16,6 +16,8 @@ setup(
             'chembl_m2t=chembl_webresource_client.scripts.chembl_m2t:main',
             'chembl_t2m=chembl_webresource_client.scripts.chembl_t2m:main',
             'chembl_act=chembl_webresource_client.scripts.chembl_act:main',
+            'chembl_cache=chembl_webresource_client.scripts.chembl_cache:main',
+            'chembl_proxy=chembl_webresource_client.scripts.chembl_proxy:main',
         ]
     },
     author='Michal Nowotka, Eloy Felix',
@@ -25,6 +27,7 @@ setup(
     license='Apache Software License',
     packages=['chembl_webresource_client',
               'chembl_webresource_client.scripts'],
+    package_data={'chembl_webresource_client': ['schemas/*.json']},
     long_description="""
     Documentation and repository: https://github.com/chembl/chembl_webresource_client.
     This is the only official Python client library developed and supported by ChEMBL (https://www.ebi.ac.uk/chembl/) group.